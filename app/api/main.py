@@ -1,11 +1,24 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, HTTPException, Query
-from fastapi.responses import ORJSONResponse
-from typing import Dict, Any
+from fastapi.responses import ORJSONResponse, PlainTextResponse
+from pydantic import BaseModel, Field
+from typing import AsyncIterator, Dict, Any, List
 import time
 
+from app.api.warmup import warmup
 from app.config import settings
+from app.utils.metrics import REGISTRY, REQUEST_SECONDS, REQUESTS_TOTAL, SEARCH_OVER_BUDGET
 
-app = FastAPI(default_response_class=ORJSONResponse, title="K-RAG API")
+
+@asynccontextmanager
+async def lifespan(_: FastAPI) -> AsyncIterator[None]:
+    # Прогрев идет в фоне: процесс сразу отвечает на /health, а /ready становится 200 после загрузки
+    if settings.warmup_on_startup:
+        warmup.start()
+    yield
+
+
+app = FastAPI(default_response_class=ORJSONResponse, title="K-RAG API", lifespan=lifespan)
 
 
 @app.get("/health")
@@ -13,19 +26,172 @@ def health() -> Dict[str, Any]:
     return {"status": "ok"}
 
 
+@app.get("/ready")
+def ready() -> ORJSONResponse:
+    if not settings.warmup_on_startup:
+        return ORJSONResponse({"ready": True, "warmup": "disabled"})
+    status = warmup.status()
+    return ORJSONResponse(status, status_code=200 if status["ready"] else 503)
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics() -> PlainTextResponse:
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+
 @app.get("/ask")
-def ask(q: str = Query(..., min_length=1, max_length=512)) -> Dict[str, Any]:
+def ask(
+    q: str = Query(..., min_length=1, max_length=512),
+    timings: bool = Query(False, description="вернуть длительность этапов в мс"),
+) -> Dict[str, Any]:
     start = time.time()
+    stage_timings: Dict[str, float] = {}
     try:
         from app.pipeline import get_pipeline
         pipeline = get_pipeline()
-        answer, sources, used_chunk_ids = pipeline.ask(q)
+        answer, sources, used_chunk_ids = pipeline.ask(q, timings=stage_timings)
         elapsed_ms = int((time.time() - start) * 1000)
-        return {
+        REQUEST_SECONDS.observe(time.time() - start, "ask")
+        REQUESTS_TOTAL.inc("ask", "ok")
+        response = {
             "answer": answer,
             "sources": sources,
             "used_chunks": used_chunk_ids,
             "elapsed_ms": elapsed_ms,
         }
+        if timings:
+            response["timings"] = stage_timings
+        return response
     except Exception as e:
+        REQUESTS_TOTAL.inc("ask", "error")
         raise HTTPException(status_code=503, detail=str(e))
+
+
+@app.get("/search")
+def search(
+    q: str = Query(..., min_length=1, max_length=512),
+    rerank: bool = Query(False, description="переранжировать кандидатов CrossEncoder"),
+    product: str | None = Query(None, max_length=32),
+    version: str | None = Query(None, max_length=32),
+    offset: int = Query(0, ge=0),
+    limit: int = Query(10, ge=1, le=50),
+    timings: bool = Query(False),
+) -> Dict[str, Any]:
+    start = time.perf_counter()
+    stage_timings: Dict[str, float] = {}
+    try:
+        from app.pipeline import get_pipeline
+        pipeline = get_pipeline()
+        hits, total = pipeline.search(q, rerank=rerank, product=product, version=version,
+                                      offset=offset, limit=limit, timings=stage_timings)
+    except Exception as e:
+        REQUESTS_TOTAL.inc("search", "error")
+        raise HTTPException(status_code=503, detail=str(e))
+    elapsed = time.perf_counter() - start
+    REQUEST_SECONDS.observe(elapsed, "search")
+    REQUESTS_TOTAL.inc("search", "ok")
+    if elapsed * 1000 > settings.search_budget_ms:
+        SEARCH_OVER_BUDGET.inc()
+    response: Dict[str, Any] = {
+        "hits": hits,
+        "total": total,
+        "offset": offset,
+        "limit": limit,
+        "elapsed_ms": round(elapsed * 1000, 2),
+    }
+    if timings:
+        response["timings"] = stage_timings
+    return response
+
+
+class BatchAskRequest(BaseModel):
+    questions: List[str] = Field(..., min_length=1)
+    timings: bool = False
+
+
+@app.post("/ask/batch")
+def ask_batch(req: BatchAskRequest) -> Dict[str, Any]:
+    if len(req.questions) > settings.batch_max_questions:
+        raise HTTPException(status_code=413, detail=f"Too many questions (max {settings.batch_max_questions})")
+    for q in req.questions:
+        if not q.strip() or len(q) > 512:
+            raise HTTPException(status_code=422, detail="Each question must be 1..512 characters")
+    start = time.time()
+    stage_timings: Dict[str, float] = {}
+    try:
+        from app.pipeline import get_pipeline
+        pipeline = get_pipeline()
+        outputs = pipeline.ask_batch(req.questions, timings=stage_timings, return_exceptions=True)
+    except Exception as e:
+        REQUESTS_TOTAL.inc("ask_batch", "error")
+        raise HTTPException(status_code=503, detail=str(e))
+    results: List[Dict[str, Any]] = []
+    for q, out in zip(req.questions, outputs):
+        if isinstance(out, Exception):
+            results.append({"question": q, "error": str(out)})
+            continue
+        answer, sources, used_chunk_ids = out
+        results.append({"question": q, "answer": answer, "sources": sources, "used_chunks": used_chunk_ids})
+    REQUEST_SECONDS.observe(time.time() - start, "ask_batch")
+    REQUESTS_TOTAL.inc("ask_batch", "ok")
+    response: Dict[str, Any] = {"results": results, "elapsed_ms": int((time.time() - start) * 1000)}
+    if req.timings:
+        response["timings"] = stage_timings
+    return response
+
+
+class IngestRequest(BaseModel):
+    stages: List[str] | None = Field(None, description="подмножество crawl, preprocess, embed, index")
+
+
+@app.post("/ingest", status_code=202)
+def ingest(req: IngestRequest | None = None) -> Dict[str, Any]:
+    from app.ingest.jobs import JobConflict, runner
+
+    try:
+        return runner.submit(req.stages if req else None)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    except JobConflict as e:
+        raise HTTPException(status_code=409, detail={"error": str(e), "job_id": e.job_id})
+
+
+@app.get("/ingest")
+def ingest_jobs(limit: int = Query(20, ge=1, le=200)) -> Dict[str, Any]:
+    from app.ingest.jobs import runner
+
+    return {"jobs": runner.list_jobs(limit)}
+
+
+@app.get("/ingest/{job_id}")
+def ingest_job(job_id: str) -> Dict[str, Any]:
+    from app.ingest.jobs import runner
+
+    try:
+        return runner.get(job_id)
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"Unknown job {job_id}")
+
+
+@app.post("/ingest/{job_id}/cancel")
+def ingest_cancel(job_id: str) -> Dict[str, Any]:
+    from app.ingest.jobs import runner
+
+    try:
+        return runner.cancel(job_id)
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"Unknown job {job_id}")
+
+
+@app.post("/ingest/{job_id}/resume", status_code=202)
+def ingest_resume(job_id: str) -> Dict[str, Any]:
+    from app.ingest.jobs import JobConflict, runner
+
+    try:
+        return runner.resume(job_id)
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"Unknown job {job_id}")
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except JobConflict as e:
+        raise HTTPException(status_code=409, detail={"error": str(e), "job_id": e.job_id})
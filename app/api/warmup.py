@@ -0,0 +1,93 @@
+from __future__ import annotations
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict
+
+from app.config import settings
+from app.utils.metrics import STARTUP_SECONDS
+
+
+PROCESS_STARTED = time.perf_counter()
+
+
+class Warmup:
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.components: Dict[str, Dict[str, Any]] = {}
+        self.ready = False
+        self.ready_after_s: float | None = None
+        self.thread: threading.Thread | None = None
+
+    def _set(self, name: str, **fields: Any) -> None:
+        with self.lock:
+            self.components.setdefault(name, {}).update(fields)
+
+    def _run_component(self, name: str, fn: Callable[[], Any]) -> bool:
+        self._set(name, state="loading")
+        t0 = time.perf_counter()
+        try:
+            fn()
+        except Exception as e:
+            self._set(name, state="error", error=str(e), seconds=round(time.perf_counter() - t0, 3))
+            return False
+        elapsed = time.perf_counter() - t0
+        STARTUP_SECONDS.set(elapsed, name)
+        self._set(name, state="ready", error=None, seconds=round(elapsed, 3))
+        return True
+
+    def _warm_embed_model(self) -> None:
+        from app.embed.ollama_client import OllamaClient
+        OllamaClient().embed(["warmup"])
+
+    def _warm_llm_model(self) -> None:
+        from app.embed.ollama_client import OllamaClient
+        OllamaClient().chat([
+            {"role": "system", "content": "Отвечай кратко."},
+            {"role": "user", "content": "Тест"},
+        ], max_tokens=1)
+
+    def run(self) -> None:
+        from app.pipeline import get_pipeline
+
+        pending: Dict[str, Callable[[], Any]] = {}
+        while True:
+            if not self._run_component("pipeline", get_pipeline):
+                time.sleep(settings.warmup_retry_s)
+                continue
+            retriever = get_pipeline().retriever
+            pending = {
+                "index": retriever._ensure_loaded,
+                "reranker": retriever._ensure_reranker,
+                "embed_model": self._warm_embed_model,
+                "llm_model": self._warm_llm_model,
+            }
+            break
+
+        # Компоненты независимы: грузим индекс, reranker и модели Ollama параллельно, упавшие повторяем
+        with ThreadPoolExecutor(max_workers=len(pending)) as pool:
+            while pending:
+                futures = {name: pool.submit(self._run_component, name, fn) for name, fn in pending.items()}
+                pending = {name: pending[name] for name, f in futures.items() if not f.result()}
+                if pending:
+                    time.sleep(settings.warmup_retry_s)
+
+        with self.lock:
+            self.ready = True
+            self.ready_after_s = round(time.perf_counter() - PROCESS_STARTED, 3)
+        STARTUP_SECONDS.set(self.ready_after_s, "total")
+
+    def start(self) -> None:
+        self.thread = threading.Thread(target=self.run, name="warmup", daemon=True)
+        self.thread.start()
+
+    def status(self) -> Dict[str, Any]:
+        with self.lock:
+            return {
+                "ready": self.ready,
+                "ready_after_s": self.ready_after_s,
+                "components": {k: dict(v) for k, v in self.components.items()},
+            }
+
+
+warmup = Warmup()
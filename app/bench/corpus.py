@@ -0,0 +1,89 @@
+from __future__ import annotations
+import random
+from typing import Any, Dict, List
+
+
+PRODUCTS = [("KSC", "15.1"), ("KATA", "7.1")]
+
+VOCAB = (
+    "сервер администрирования агент политика задача устройство группа обновление установка "
+    "лицензия отчет инцидент песочница сенсор интеграция правило событие консоль база данных "
+    "сеть точка распространения параметр настройка пользователь роль доступ уведомление журнал "
+    "проверка угроза объект файл процесс хост узел кластер резервное копирование восстановление "
+    "требования память процессор диск версия компонент плагин веб-консоль api siem syslog"
+).split()
+
+CJK_LINE = "这是一个测试行"
+
+
+def _sentence(rng: random.Random, words: int) -> str:
+    return " ".join(rng.choice(VOCAB) for _ in range(words)).capitalize() + "."
+
+
+def synthetic_text(n_words: int, seed: int = 0) -> str:
+    rng = random.Random(seed)
+    parts: List[str] = []
+    total = 0
+    while total < n_words:
+        k = rng.randint(6, 18)
+        parts.append(_sentence(rng, k))
+        total += k
+    return " ".join(parts)
+
+
+def synthetic_html(n_paragraphs: int = 20, seed: int = 0, product: str = "KSC", version: str = "15.1") -> str:
+    rng = random.Random(seed)
+    page_id = rng.randint(1000, 999999)
+    url = f"https://support.kaspersky.com/{product}/{version}/ru-RU/{page_id}.htm"
+    body: List[str] = [f"<h1>{_sentence(rng, 4)}</h1>", f"<h2>{_sentence(rng, 3)}</h2>"]
+    for i in range(n_paragraphs):
+        body.append(f"<p>{_sentence(rng, rng.randint(20, 60))}<br>{_sentence(rng, 10)}</p>")
+        if i % 7 == 3:
+            rows = "".join(
+                f"<tr><td>{rng.choice(VOCAB)}</td><td>{rng.randint(1, 64)} ГБ</td></tr>" for _ in range(5)
+            )
+            body.append(f"<table><tr><th>Параметр</th><th>Значение</th></tr>{rows}</table>")
+    nav = "".join(f'<a href="/{product}/{version}/ru-RU/{rng.randint(1, 9999)}.htm">{rng.choice(VOCAB)}</a>' for _ in range(30))
+    return (
+        f'<html><head><link rel="canonical" href="{url}"><script>var x = 1;</script></head>'
+        f"<body><header>{nav}</header><nav>{nav}</nav><main>{''.join(body)}</main>"
+        f"<footer>© AO Kaspersky Lab</footer></body></html>"
+    )
+
+
+def synthetic_chunks(n: int, seed: int = 0, words: int = 300) -> List[Dict[str, Any]]:
+    rng = random.Random(seed)
+    rows: List[Dict[str, Any]] = []
+    for i in range(n):
+        product, version = PRODUCTS[i % len(PRODUCTS)]
+        page = i // 3
+        rows.append({
+            "id": f"{product}_{version}:synthetic-{page}:{i % 3}",
+            "text": synthetic_text(words, seed=rng.randint(0, 2**31)),
+            "meta": {
+                "product": product,
+                "version": version,
+                "url": f"https://support.kaspersky.com/{product}/{version}/ru-RU/{100000 + page}.htm",
+                "h1": _sentence(rng, 4),
+                "h2": None,
+            },
+        })
+    return rows
+
+
+def synthetic_queries(n: int, seed: int = 0) -> List[str]:
+    rng = random.Random(seed)
+    return [f"Как {_sentence(rng, rng.randint(4, 9)).lower()}" for _ in range(n)]
+
+
+def synthetic_answer(n_lines: int = 30, seed: int = 0) -> str:
+    rng = random.Random(seed)
+    lines: List[str] = []
+    for i in range(n_lines):
+        if i % 10 == 9:
+            lines.append(CJK_LINE)
+        elif i % 6 == 5:
+            lines.extend(["", "", ""])
+        else:
+            lines.append(_sentence(rng, rng.randint(5, 15)))
+    return "\n".join(lines)
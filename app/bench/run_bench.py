@@ -0,0 +1,205 @@
+from __future__ import annotations
+import argparse
+import json
+import statistics
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Tuple
+
+import numpy as np
+
+from app.bench.corpus import synthetic_answer, synthetic_chunks, synthetic_html, synthetic_queries, synthetic_text
+from app.bench.stub_ollama import StubOllama, hash_embed
+from app.config import settings
+from app.utils.io import data_path
+
+
+class LexicalCrossEncoder:
+    # Заменяет CrossEncoder в бенчмарках: доля общих слов запроса и пассажа
+    def predict(self, pairs: List[Tuple[str, str]]) -> np.ndarray:
+        scores = []
+        for query, passage in pairs:
+            q = set(query.lower().split())
+            p = set(passage.lower().split())
+            scores.append(len(q & p) / (len(q) or 1))
+        return np.asarray(scores, dtype=np.float32)
+
+
+def measure(fn: Callable[[], Any], repeat: int, warmup: int = 1) -> Dict[str, float]:
+    for _ in range(warmup):
+        fn()
+    samples: List[float] = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - t0) * 1000)
+    return {
+        "repeat": repeat,
+        "min_ms": round(min(samples), 4),
+        "median_ms": round(statistics.median(samples), 4),
+        "max_ms": round(max(samples), 4),
+    }
+
+
+def build_synthetic_index(rows: List[Dict[str, Any]], dim: int):
+    from app.index.faiss_store import build_hnsw_index
+
+    vecs = hash_embed([r["text"] for r in rows], dim)
+    vecs /= np.linalg.norm(vecs, axis=1, keepdims=True) + 1e-12
+    index = build_hnsw_index(vecs, m=settings.hnsw_m, ef_construction=settings.hnsw_ef_construction)
+    index.hnsw.efSearch = settings.hnsw_ef_search
+    metas = []
+    for r in rows:
+        meta = dict(r["meta"])
+        meta["text"] = r["text"]
+        meta["id"] = r["id"]
+        metas.append(meta)
+    return index, metas
+
+
+def run_benchmarks(args: argparse.Namespace) -> Dict[str, Any]:
+    from app.preprocess.clean_and_chunk import chunk_text, clean_html, extract_text
+    from app.index import faiss_store
+    from app.index.build_index import embed_texts
+    from app.generation.generate import sanitize_answer
+    from app.pipeline import Pipeline
+
+    results: Dict[str, Any] = {}
+    rows = synthetic_chunks(args.chunks, seed=args.seed)
+    queries = synthetic_queries(args.queries, seed=args.seed)
+    text = synthetic_text(args.words, seed=args.seed)
+    pages = [synthetic_html(args.paragraphs, seed=args.seed + i) for i in range(args.pages)]
+    answer = synthetic_answer(seed=args.seed)
+
+    results["chunk_text"] = measure(lambda: chunk_text(text, 300, 60), args.repeat)
+    results["chunk_text"]["chunks"] = len(chunk_text(text, 300, 60))
+
+    results["clean_html+extract_text"] = measure(
+        lambda: [extract_text(clean_html(p)) for p in pages], args.repeat
+    )
+    results["clean_html+extract_text"]["pages"] = len(pages)
+
+    results["sanitize_answer"] = measure(lambda: sanitize_answer(answer), args.repeat)
+
+    index, metas = build_synthetic_index(rows, args.dim)
+    qvecs = hash_embed(queries, args.dim)
+    qvecs /= np.linalg.norm(qvecs, axis=1, keepdims=True) + 1e-12
+    qi = iter(range(10**9))
+    results["faiss_store.search"] = measure(
+        lambda: faiss_store.search(index, qvecs[next(qi) % len(queries)][None, :], settings.topk), args.repeat
+    )
+    results["faiss_store.search"]["ntotal"] = int(index.ntotal)
+
+    with StubOllama(dim=args.dim, embed_latency_ms=args.embed_latency_ms, chat_latency_ms=args.chat_latency_ms) as stub:
+        settings.ollama_url = stub.url
+        embed_batch = [r["text"] for r in rows[: args.embed_texts]]
+        results["embed_texts"] = measure(lambda: embed_texts(embed_batch), args.repeat)
+        results["embed_texts"]["texts"] = len(embed_batch)
+
+        pipeline = Pipeline()
+        pipeline.retriever.use_index(index, metas)
+        pipeline.retriever.cross_encoder = LexicalCrossEncoder()
+        hits, _ = pipeline.retriever.ann_search(queries[0], topk=settings.topk)
+
+        results["Retriever.rerank"] = measure(
+            lambda: pipeline.retriever.rerank(queries[0], [dict(h) for h in hits], topn=settings.topn_context),
+            args.repeat,
+        )
+        results["Retriever.rerank"]["hits"] = len(hits)
+        results["Pipeline._filter_by_majority_product"] = measure(
+            lambda: pipeline._filter_by_majority_product(hits), args.repeat
+        )
+        for rerank in (False, True):
+            name = "Pipeline.search" + ("+rerank" if rerank else "")
+            results[name] = measure(
+                lambda: pipeline.search(queries[next(qi) % len(queries)], rerank=rerank, limit=10), args.repeat
+            )
+        results["Pipeline.search"]["budget_ms"] = settings.search_budget_ms
+        results["Pipeline.ask"] = measure(lambda: pipeline.ask(queries[next(qi) % len(queries)]), args.repeat)
+        results["stub_calls"] = dict(stub.config.calls)
+    return results
+
+
+def pool_scenario(args: argparse.Namespace) -> Dict[str, Any]:
+    from concurrent.futures import ThreadPoolExecutor
+    from app.embed.backend_pool import BackendPool
+    from app.embed.ollama_client import OllamaClient
+
+    # N заглушек за одним пулом; с --fail-one первая отвечает 500 на все вызовы и должна быть выведена из ротации
+    stubs = [
+        StubOllama(dim=args.dim, chat_latency_ms=args.chat_latency_ms,
+                   fail_rate=1.0 if args.fail_one and i == 0 else 0.0).start()
+        for i in range(args.backends)
+    ]
+    try:
+        pool = BackendPool("bench", [s.url for s in stubs])
+        client = OllamaClient(embed_pool=pool, chat_pool=pool)
+        messages = [{"role": "user", "content": "Тест"}]
+        n_calls = args.backends * 8
+        t0 = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.backends * 2) as ex:
+            list(ex.map(lambda _: client.chat(messages, max_tokens=8), range(n_calls)))
+        elapsed = time.perf_counter() - t0
+        return {
+            "backends": args.backends,
+            "calls": n_calls,
+            "elapsed_ms": round(elapsed * 1000, 3),
+            "calls_per_backend": [s.config.calls.get("/api/chat", 0) for s in stubs],
+            "pool": pool.status(),
+        }
+    finally:
+        for stub in stubs:
+            stub.stop()
+
+
+def compare(results: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    regressions: List[str] = []
+    for name, cur in results.items():
+        # у retrieval-only пути свой абсолютный бюджет, независимо от базы
+        if isinstance(cur, dict) and "budget_ms" in cur and cur["median_ms"] > cur["budget_ms"]:
+            regressions.append(f"{name}: {cur['median_ms']:.3f}ms over budget {cur['budget_ms']}ms")
+    for name, base in baseline.get("results", {}).items():
+        cur = results.get(name)
+        if not isinstance(base, dict) or not isinstance(cur, dict) or "median_ms" not in base:
+            continue
+        if cur["median_ms"] > base["median_ms"] * tolerance:
+            regressions.append(f"{name}: {cur['median_ms']:.3f}ms > {base['median_ms']:.3f}ms x {tolerance}")
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Микробенчмарки горячих путей на синтетике и заглушке Ollama")
+    parser.add_argument("--chunks", type=int, default=2000, help="размер синтетического индекса")
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--pages", type=int, default=10)
+    parser.add_argument("--paragraphs", type=int, default=30)
+    parser.add_argument("--words", type=int, default=20000, help="длина текста для chunk_text")
+    parser.add_argument("--embed-texts", type=int, default=64)
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--embed-latency-ms", type=float, default=0.0)
+    parser.add_argument("--chat-latency-ms", type=float, default=0.0)
+    parser.add_argument("--backends", type=int, default=0, help="прогнать сценарий пула на N заглушках")
+    parser.add_argument("--fail-one", action="store_true", help="в сценарии пула одна заглушка всегда отвечает 500")
+    parser.add_argument("--baseline", type=Path, default=None, help="отчет для сравнения")
+    parser.add_argument("--tolerance", type=float, default=1.5, help="допустимое замедление медианы")
+    parser.add_argument("--out", type=Path, default=data_path("eval", "bench_report.json"))
+    args = parser.parse_args()
+
+    report = {"params": {k: (str(v) if isinstance(v, Path) else v) for k, v in vars(args).items()},
+              "results": run_benchmarks(args)}
+    if args.backends:
+        report["results"]["ollama_pool"] = pool_scenario(args)
+    args.out.write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+    print(json.dumps(report["results"], ensure_ascii=False, indent=2))
+
+    baseline = json.loads(args.baseline.read_text(encoding="utf-8")) if args.baseline else {}
+    regressions = compare(report["results"], baseline, args.tolerance)
+    for line in regressions:
+        print(f"REGRESSION {line}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
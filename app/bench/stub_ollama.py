@@ -0,0 +1,157 @@
+from __future__ import annotations
+import argparse
+import hashlib
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List
+
+import numpy as np
+
+
+_token_cache: Dict[tuple, np.ndarray] = {}
+_token_lock = threading.Lock()
+
+
+def _token_vector(token: str, dim: int) -> np.ndarray:
+    key = (token, dim)
+    vec = _token_cache.get(key)
+    if vec is None:
+        seed = int.from_bytes(hashlib.md5(token.encode("utf-8")).digest()[:8], "little")
+        vec = np.random.default_rng(seed).standard_normal(dim).astype(np.float32)
+        with _token_lock:
+            _token_cache[key] = vec
+    return vec
+
+
+def hash_embed(texts: List[str], dim: int = 768) -> np.ndarray:
+    # Детерминированные "эмбеддинги": сумма случайных векторов токенов, тексты с общими словами оказываются рядом
+    out = np.zeros((len(texts), dim), dtype=np.float32)
+    for i, text in enumerate(texts):
+        for token in text.lower().split():
+            out[i] += _token_vector(token, dim)
+    return out
+
+
+class StubConfig:
+    def __init__(self, dim: int = 768, embed_latency_ms: float = 0.0, chat_latency_ms: float = 0.0,
+                 fail_rate: float = 0.0, answer: str = "Ответ по контексту.") -> None:
+        self.dim = dim
+        self.embed_latency_ms = embed_latency_ms
+        self.chat_latency_ms = chat_latency_ms
+        self.fail_rate = fail_rate
+        self.answer = answer
+        self.calls: Dict[str, int] = {}
+        self.lock = threading.Lock()
+
+    def count(self, path: str) -> int:
+        with self.lock:
+            self.calls[path] = self.calls.get(path, 0) + 1
+            return self.calls[path]
+
+
+def _make_handler(cfg: StubConfig) -> type:
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        disable_nagle_algorithm = True
+
+        def log_message(self, *args: Any) -> None:
+            pass
+
+        def _send(self, status: int, payload: Dict[str, Any]) -> None:
+            body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _should_fail(self, n: int) -> bool:
+            # детерминированная доля ошибок: каждый k-й вызов
+            return cfg.fail_rate > 0 and n % max(1, round(1 / cfg.fail_rate)) == 0
+
+        def do_GET(self) -> None:
+            if self.path in ("/", "/api/tags", "/api/version"):
+                self._send(200, {"models": [{"name": "stub"}], "version": "stub"})
+            else:
+                self._send(404, {"error": "not found"})
+
+        def do_POST(self) -> None:
+            length = int(self.headers.get("Content-Length") or 0)
+            data = json.loads(self.rfile.read(length) or b"{}")
+            n = cfg.count(self.path)
+            if self._should_fail(n):
+                self._send(500, {"error": "stub failure"})
+                return
+            if self.path == "/api/embeddings":
+                time.sleep(cfg.embed_latency_ms / 1000)
+                vec = hash_embed([str(data.get("prompt", ""))], cfg.dim)[0]
+                self._send(200, {"embedding": vec.tolist()})
+            elif self.path == "/api/embed":
+                inputs = data.get("input", [])
+                if isinstance(inputs, str):
+                    inputs = [inputs]
+                time.sleep(cfg.embed_latency_ms / 1000)
+                self._send(200, {"embeddings": hash_embed([str(t) for t in inputs], cfg.dim).tolist()})
+            elif self.path == "/api/chat":
+                time.sleep(cfg.chat_latency_ms / 1000)
+                self._send(200, {"message": {"role": "assistant", "content": cfg.answer}, "done": True})
+            elif self.path == "/api/generate":
+                time.sleep(cfg.chat_latency_ms / 1000)
+                self._send(200, {"response": cfg.answer, "done": True})
+            else:
+                self._send(404, {"error": "not found"})
+
+    return Handler
+
+
+class StubOllama:
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, **config: Any) -> None:
+        self.config = StubConfig(**config)
+        self.server = ThreadingHTTPServer((host, port), _make_handler(self.config))
+        self.server.daemon_threads = True
+        self.thread: threading.Thread | None = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "StubOllama":
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self) -> "StubOllama":
+        return self.start()
+
+    def __exit__(self, *exc: Any) -> None:
+        self.stop()
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Локальная заглушка Ollama (embeddings/chat)")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11435)
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--embed-latency-ms", type=float, default=0.0)
+    parser.add_argument("--chat-latency-ms", type=float, default=0.0)
+    parser.add_argument("--fail-rate", type=float, default=0.0)
+    args = parser.parse_args()
+    stub = StubOllama(args.host, args.port, dim=args.dim, embed_latency_ms=args.embed_latency_ms,
+                      chat_latency_ms=args.chat_latency_ms, fail_rate=args.fail_rate)
+    print(f"stub ollama listening on {stub.url}")
+    try:
+        stub.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
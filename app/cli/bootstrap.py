@@ -1,16 +1,26 @@
 from __future__ import annotations
-import sys
+import argparse
+import json
 
-from app.crawler import crawl
-from app.preprocess import clean_and_chunk
-from app.index import build_index
+from app.ingest.jobs import STAGES, runner
 from app.embed.ollama_client import OllamaClient
 
 
 def main() -> int:
-    crawl.run()
-    clean_and_chunk.process_raw_to_chunks()
-    build_index.build_from_chunks()
+    parser = argparse.ArgumentParser(description="Краулинг, препроцессинг, эмбеддинг и сборка индекса как задание загрузки")
+    parser.add_argument("--stages", default=",".join(STAGES), help="этапы через запятую")
+    parser.add_argument("--resume", metavar="JOB_ID", help="продолжить задание с первого незавершенного этапа")
+    args = parser.parse_args()
+    if args.resume:
+        job = runner.resume(args.resume, background=False)
+    else:
+        try:
+            job = runner.submit([s.strip() for s in args.stages.split(",") if s.strip()], background=False)
+        except ValueError as e:
+            parser.error(str(e))
+    print(json.dumps(job, ensure_ascii=False, indent=2))
+    if job["status"] != "succeeded":
+        return 1
     try:
         client = OllamaClient()
         client.embed(["warmup"])
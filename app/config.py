@@ -5,6 +5,11 @@ from pathlib import Path
 
 class Settings(BaseSettings):
     ollama_url: str = Field(default="http://localhost:11434", alias="OLLAMA_URL")
+    ollama_embed_urls: str | None = Field(default=None, alias="OLLAMA_EMBED_URLS")
+    ollama_chat_urls: str | None = Field(default=None, alias="OLLAMA_CHAT_URLS")
+    ollama_max_failures: int = Field(default=3, alias="OLLAMA_MAX_FAILURES")
+    ollama_eject_s: float = Field(default=30.0, alias="OLLAMA_EJECT_S")
+    ollama_health_interval_s: float = Field(default=10.0, alias="OLLAMA_HEALTH_INTERVAL_S")
     embed_model: str = Field(default="nomic-embed-text", alias="EMBED_MODEL")
     llm_model: str = Field(default="llama3.2", alias="LLM_MODEL")
     rerank_model: str = Field(default="BAAI/bge-reranker-base", alias="RERANK_MODEL")
@@ -15,10 +20,25 @@ class Settings(BaseSettings):
     hnsw_m: int = Field(default=32, alias="HNSW_M")
     hnsw_ef_construction: int = Field(default=200, alias="HNSW_EF_CONSTRUCTION")
     hnsw_ef_search: int = Field(default=64, alias="HNSW_EF_SEARCH")
+    index_shards: int = Field(default=1, alias="INDEX_SHARDS")
+    shard_urls: str | None = Field(default=None, alias="SHARD_URLS")
+    shard_base_port: int = Field(default=8100, alias="SHARD_BASE_PORT")
+    shard_timeout: float = Field(default=10.0, alias="SHARD_TIMEOUT")
+    index_train_size: int = Field(default=10000, alias="INDEX_TRAIN_SIZE")
     topk: int = Field(default=15, alias="TOPK")
     topn_context: int = Field(default=3, alias="TOPN_CONTEXT")
 
+    search_budget_ms: float = Field(default=50.0, alias="SEARCH_BUDGET_MS")
+    search_max_k: int = Field(default=200, alias="SEARCH_MAX_K")
+    search_overfetch: int = Field(default=4, alias="SEARCH_OVERFETCH")
+    search_snippet_chars: int = Field(default=300, alias="SEARCH_SNIPPET_CHARS")
+
     embed_batch: int = Field(default=32, alias="EMBED_BATCH")
+    embed_reduce: str = Field(default="none", alias="EMBED_REDUCE")
+    embed_reduce_dim: int = Field(default=256, alias="EMBED_REDUCE_DIM")
+    batch_max_questions: int = Field(default=256, alias="BATCH_MAX_QUESTIONS")
+    batch_generate_concurrency: int = Field(default=4, alias="BATCH_GENERATE_CONCURRENCY")
+    coalesce_requests: bool = Field(default=True, alias="COALESCE_REQUESTS")
 
     request_timeout: float = Field(default=30.0, alias="REQUEST_TIMEOUT")
     crawl_seed_limit: int = Field(default=30, alias="CRAWL_SEED_LIMIT")
@@ -28,6 +48,9 @@ class Settings(BaseSettings):
 
     api_host: str = Field(default="0.0.0.0", alias="API_HOST")
     api_port: int = Field(default=8000, alias="API_PORT")
+    warmup_on_startup: bool = Field(default=True, alias="WARMUP_ON_STARTUP")
+    warmup_retry_s: float = Field(default=5.0, alias="WARMUP_RETRY_S")
+    ingest_auto_bootstrap: bool = Field(default=True, alias="INGEST_AUTO_BOOTSTRAP")
 
     data_dir: Path = Field(default=Path("data"), alias="DATA_DIR")
 
@@ -1,12 +1,13 @@
 from __future__ import annotations
 from typing import Set, List, Dict
 from urllib.parse import urljoin, urlparse, urlencode
-from pathlib import Path
+from datetime import datetime, timezone
 import re
 import httpx
 from bs4 import BeautifulSoup
 
-from app.utils.io import ensure_dir, data_path, slugify, write_jsonl
+from app.crawler import raw_store
+from app.utils.io import write_jsonl
 from app.config import settings
 
 
@@ -166,8 +167,7 @@ def crawl_depth1() -> List[Dict]:
                     html = fetch(page_url, client)
                     if not html:
                         continue
-                    path = save_raw(product, version, page_url, html)
-                    results.append({"product": product, "version": version, "url": page_url, "path": str(path)})
+                    results.append(save_raw(product, version, page_url, html))
         else:
             for seed in SEEDS:
                 product = seed["product"]
@@ -191,25 +191,28 @@ def crawl_depth1() -> List[Dict]:
                     html = fetch(url, client)
                     if not html:
                         continue
-                    path = save_raw(product, version, url, html)
-                    results.append({"product": product, "version": version, "url": url, "path": str(path)})
+                    results.append(save_raw(product, version, url, html))
     return results
 
 
-def save_raw(product: str, version: str, url: str, html: str) -> Path:
-    out_dir = data_path("raw", f"{product}_{version}")
-    ensure_dir(out_dir)
-    name = slugify(url)[:150] or "index"
-    out_path = out_dir / f"{name}.html"
-    out_path.write_text(html, encoding="utf-8")
-    return out_path
+def save_raw(product: str, version: str, url: str, html: str) -> Dict:
+    sha, path = raw_store.put(html)
+    return {
+        "product": product,
+        "version": version,
+        "url": url,
+        "doc_id": raw_store.doc_id(url),
+        "sha256": sha,
+        "path": str(path),
+        "fetched_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+    }
 
 
 def run() -> List[Dict]:
     results = crawl_depth1()
     if results:
-        manifest_path = data_path("raw", "manifest.jsonl")
-        write_jsonl(manifest_path, results)
+        write_jsonl(raw_store.MANIFEST_FILE, results)
+        raw_store.prune(results)
     return results
 
 
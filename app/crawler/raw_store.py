@@ -0,0 +1,59 @@
+from __future__ import annotations
+import gzip
+import hashlib
+import os
+from pathlib import Path
+from typing import Dict, Iterable, Set
+
+from app.utils.io import data_path, ensure_dir
+
+
+OBJECTS_DIR = data_path("raw", "objects")
+MANIFEST_FILE = data_path("raw", "manifest.jsonl")
+
+
+def content_hash(html: str) -> str:
+    return hashlib.sha256(html.encode("utf-8")).hexdigest()
+
+
+def doc_id(url: str) -> str:
+    # Стабильный короткий идентификатор страницы: не зависит от длины URL и не коллидирует после обрезки
+    return hashlib.sha256(url.encode("utf-8")).hexdigest()[:16]
+
+
+def object_path(sha: str) -> Path:
+    return OBJECTS_DIR / sha[:2] / f"{sha}.html.gz"
+
+
+def put(html: str) -> tuple[str, Path]:
+    sha = content_hash(html)
+    path = object_path(sha)
+    if path.exists():
+        # та же страница при повторном краулинге: байты уже лежат на диске
+        return sha, path
+    ensure_dir(path.parent)
+    tmp = path.with_name(path.name + ".tmp")
+    with gzip.open(tmp, "wb", compresslevel=6) as f:
+        f.write(html.encode("utf-8"))
+    os.replace(tmp, path)
+    return sha, path
+
+
+def read_text(path: Path) -> str:
+    # старые выгрузки хранили несжатый .html
+    if path.suffix == ".gz":
+        with gzip.open(path, "rb") as f:
+            return f.read().decode("utf-8", errors="ignore")
+    return path.read_text(encoding="utf-8", errors="ignore")
+
+
+def prune(entries: Iterable[Dict]) -> int:
+    keep: Set[str] = {str(e["sha256"]) for e in entries if e.get("sha256")}
+    removed = 0
+    if not OBJECTS_DIR.exists():
+        return removed
+    for path in OBJECTS_DIR.glob("*/*.html.gz"):
+        if path.name[: -len(".html.gz")] not in keep:
+            path.unlink(missing_ok=True)
+            removed += 1
+    return removed
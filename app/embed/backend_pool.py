@@ -0,0 +1,137 @@
+from __future__ import annotations
+import itertools
+import threading
+import time
+from typing import Any, Dict, List, Sequence, Tuple
+
+import httpx
+
+from app.config import settings
+from app.utils.metrics import REGISTRY
+
+
+POOL_OUTSTANDING = REGISTRY.gauge("krag_ollama_backend_outstanding", "Requests in flight per Ollama backend", ["pool", "backend"])
+POOL_HEALTHY = REGISTRY.gauge("krag_ollama_backend_healthy", "1 if the Ollama backend is in rotation", ["pool", "backend"])
+POOL_EJECTIONS = REGISTRY.counter("krag_ollama_backend_ejections_total", "Ollama backends taken out of rotation", ["pool", "backend"])
+
+
+class Backend:
+    def __init__(self, url: str, timeout: float) -> None:
+        self.url = url.rstrip("/")
+        self.client = httpx.Client(base_url=self.url, timeout=timeout)
+        self.outstanding = 0
+        self.consecutive_failures = 0
+        self.ejected_until = 0.0
+
+    def healthy(self, now: float) -> bool:
+        return self.ejected_until <= now
+
+
+class BackendPool:
+    def __init__(self, name: str, urls: Sequence[str], timeout: float = 300.0) -> None:
+        if not urls:
+            raise ValueError(f"Ollama pool '{name}' has no backends")
+        self.name = name
+        self.backends = [Backend(u, timeout) for u in urls]
+        self.lock = threading.Lock()
+        self._rr = itertools.count()
+        for b in self.backends:
+            POOL_OUTSTANDING.set_function(lambda b=b: b.outstanding, name, b.url)
+            POOL_HEALTHY.set_function(lambda b=b: float(b.healthy(time.monotonic())), name, b.url)
+        self._health_thread: threading.Thread | None = None
+        if len(self.backends) > 1:
+            self._health_thread = threading.Thread(target=self._health_loop, name=f"ollama-health-{name}", daemon=True)
+            self._health_thread.start()
+
+    def acquire(self, exclude: Sequence[Backend] = ()) -> Backend:
+        with self.lock:
+            now = time.monotonic()
+            candidates = [b for b in self.backends if b not in exclude and b.healthy(now)]
+            if not candidates:
+                # все выведены из ротации: лучше попытаться, чем отказать сразу
+                candidates = sorted((b for b in self.backends if b not in exclude), key=lambda b: b.ejected_until)[:1]
+            if not candidates:
+                raise RuntimeError(f"No Ollama backends left in pool '{self.name}'")
+            least = min(b.outstanding for b in candidates)
+            tied = [b for b in candidates if b.outstanding == least]
+            backend = tied[next(self._rr) % len(tied)]
+            backend.outstanding += 1
+            return backend
+
+    def release(self, backend: Backend, ok: bool) -> None:
+        with self.lock:
+            backend.outstanding -= 1
+            if ok:
+                backend.consecutive_failures = 0
+                return
+            backend.consecutive_failures += 1
+            if len(self.backends) > 1 and backend.consecutive_failures >= settings.ollama_max_failures:
+                backend.ejected_until = time.monotonic() + settings.ollama_eject_s
+                backend.consecutive_failures = 0
+                POOL_EJECTIONS.inc(self.name, backend.url)
+
+    def request(self, method: str, path: str, **kwargs: Any) -> httpx.Response:
+        tried: List[Backend] = []
+        last_exc: Exception | None = None
+        resp: httpx.Response | None = None
+        for _ in range(len(self.backends)):
+            try:
+                backend = self.acquire(exclude=tried)
+            except RuntimeError:
+                break
+            tried.append(backend)
+            try:
+                resp = backend.client.request(method, path, **kwargs)
+            except httpx.TransportError as e:
+                self.release(backend, ok=False)
+                last_exc = e
+                continue
+            if resp.status_code >= 500:
+                self.release(backend, ok=False)
+                continue
+            self.release(backend, ok=True)
+            return resp
+        if resp is not None:
+            return resp
+        assert last_exc is not None
+        raise last_exc
+
+    def _health_loop(self) -> None:
+        # Активная проверка: недоступный узел выводится из ротации (или остается выведенным) еще на OLLAMA_EJECT_S
+        while True:
+            time.sleep(settings.ollama_health_interval_s)
+            for b in self.backends:
+                try:
+                    ok = b.client.get("/api/tags", timeout=5.0).status_code == 200
+                except httpx.HTTPError:
+                    ok = False
+                if ok:
+                    continue
+                with self.lock:
+                    if b.healthy(time.monotonic()):
+                        POOL_EJECTIONS.inc(self.name, b.url)
+                    b.ejected_until = time.monotonic() + settings.ollama_eject_s
+
+    def status(self) -> List[Dict[str, Any]]:
+        now = time.monotonic()
+        with self.lock:
+            return [{"url": b.url, "outstanding": b.outstanding, "healthy": b.healthy(now)} for b in self.backends]
+
+
+def parse_urls(value: str | None) -> List[str]:
+    return [u.strip() for u in (value or "").split(",") if u.strip()]
+
+
+_pools: Dict[Tuple[str, Tuple[str, ...]], BackendPool] = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(kind: str) -> BackendPool:
+    explicit = settings.ollama_embed_urls if kind == "embed" else settings.ollama_chat_urls
+    urls = tuple(parse_urls(explicit) or parse_urls(settings.ollama_url))
+    key = (kind, urls)
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = _pools[key] = BackendPool(kind, urls)
+        return pool
@@ -3,22 +3,32 @@ import httpx
 import numpy as np
 
 from app.config import settings
+from app.embed.backend_pool import BackendPool, get_pool
+from app.utils.metrics import OLLAMA_ERRORS, OLLAMA_INFLIGHT
 
 
 class OllamaClient:
-    def __init__(self, base_url: str | None = None):
+    # /api/embed (пакетный) есть только в новых версиях Ollama; после первого 404 используем /api/embeddings
+    batch_embed_supported: bool = True
+
+    def __init__(self, base_url: str | None = None, embed_pool: BackendPool | None = None,
+                 chat_pool: BackendPool | None = None):
         self.base_url = base_url or settings.ollama_url
-        self.client = httpx.Client(base_url=self.base_url, timeout=300.0)
+        if base_url:
+            pool = BackendPool("client", [base_url])
+            embed_pool, chat_pool = embed_pool or pool, chat_pool or pool
+        self.embed_pool = embed_pool or get_pool("embed")
+        self.chat_pool = chat_pool or get_pool("chat")
 
     def _embed_once(self, text: str, model_name: str) -> List[float]:
-        resp = self.client.post("/api/embeddings", json={"model": model_name, "prompt": text})
+        resp = self.embed_pool.request("POST", "/api/embeddings", json={"model": model_name, "prompt": text})
         resp.raise_for_status()
         data = resp.json()
         if isinstance(data, dict) and "embedding" in data and isinstance(data["embedding"], list):
             return data["embedding"]
         if isinstance(data, dict) and "embeddings" in data and isinstance(data["embeddings"], list) and data["embeddings"]:
             return data["embeddings"][0]
-        resp2 = self.client.post("/api/embeddings", json={"model": model_name, "prompt": text})
+        resp2 = self.embed_pool.request("POST", "/api/embeddings", json={"model": model_name, "prompt": text})
         resp2.raise_for_status()
         data2 = resp2.json()
         if isinstance(data2, dict) and "embedding" in data2 and isinstance(data2["embedding"], list):
@@ -27,21 +37,58 @@ class OllamaClient:
             return data2["embeddings"][0]
         raise RuntimeError("Ollama embeddings response has no 'embedding' field")
 
+    def _embed_batch(self, texts: List[str], model_name: str) -> List[List[float]] | None:
+        if not OllamaClient.batch_embed_supported:
+            return None
+        resp = self.embed_pool.request("POST", "/api/embed", json={"model": model_name, "input": texts})
+        if resp.status_code in (404, 405) and "model" not in resp.text.lower():
+            OllamaClient.batch_embed_supported = False
+            return None
+        resp.raise_for_status()
+        data = resp.json()
+        embeddings = data.get("embeddings") if isinstance(data, dict) else None
+        if not isinstance(embeddings, list) or len(embeddings) != len(texts):
+            return None
+        return embeddings
+
     def embed(self, texts: List[str], model: str | None = None) -> np.ndarray:
         model_name = model or settings.embed_model
         vectors: List[List[float]] = []
-        for t in texts:
-            emb = self._embed_once(t, model_name)
-            vectors.append(emb)
+        OLLAMA_INFLIGHT.inc("embed")
+        try:
+            # одиночный запрос тоже идет через /api/embed: вектор вопроса не должен зависеть от размера пакета
+            batch = self._embed_batch(texts, model_name) if texts else None
+            if batch is not None:
+                vectors = batch
+            else:
+                for t in texts:
+                    emb = self._embed_once(t, model_name)
+                    vectors.append(emb)
+        except Exception:
+            OLLAMA_ERRORS.inc("embed")
+            raise
+        finally:
+            OLLAMA_INFLIGHT.dec("embed")
         arr = np.array(vectors, dtype=np.float32)
         if arr.ndim != 2 or arr.shape[1] == 0:
             raise RuntimeError(f"Invalid embeddings shape: {arr.shape}")
         return arr
 
     def chat(self, messages: List[Dict[str, str]], model: str | None = None, temperature: float = 0.2, max_tokens: int = 192) -> str:
+        OLLAMA_INFLIGHT.inc("chat")
+        try:
+            return self._chat(messages, model, temperature, max_tokens)
+        except Exception:
+            OLLAMA_ERRORS.inc("chat")
+            raise
+        finally:
+            OLLAMA_INFLIGHT.dec("chat")
+
+    def _chat(self, messages: List[Dict[str, str]], model: str | None, temperature: float, max_tokens: int) -> str:
         model_name = model or settings.llm_model
         try:
-            resp = self.client.post(
+            resp = self.chat_pool.request(
+                "POST",
                 "/api/chat",
                 json={
                     "model": model_name,
@@ -70,7 +117,7 @@ class OllamaClient:
             }
             if system_content:
                 payload["system"] = system_content
-            r2 = self.client.post("/api/generate", json=payload)
+            r2 = self.chat_pool.request("POST", "/api/generate", json=payload)
             r2.raise_for_status()
             d2 = r2.json()
             return d2.get("response", "")
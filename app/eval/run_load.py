@@ -0,0 +1,200 @@
+from __future__ import annotations
+import argparse
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, List
+
+import httpx
+import numpy as np
+
+from app.eval.run_eval_sequential import load_questions
+from app.utils.io import data_path
+
+
+QUESTION_FIELDS = ("question", "q", "query")
+
+
+def load_workload(path: Path) -> List[str]:
+    questions: List[str] = []
+    for row in load_questions(path):
+        for field in QUESTION_FIELDS:
+            if row.get(field):
+                questions.append(str(row[field]))
+                break
+    return questions
+
+
+def percentiles(values: List[float]) -> Dict[str, float]:
+    if not values:
+        return {"count": 0}
+    arr = np.asarray(values, dtype=np.float64)
+    p50, p95, p99 = np.percentile(arr, [50, 95, 99]).tolist()
+    return {
+        "count": int(arr.size),
+        "mean": round(float(arr.mean()), 2),
+        "p50": round(p50, 2),
+        "p95": round(p95, 2),
+        "p99": round(p99, 2),
+        "max": round(float(arr.max()), 2),
+    }
+
+
+class LoadRecorder:
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.stages: Dict[str, List[float]] = {}
+        self.ok = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.error_samples: List[str] = []
+        self.sent: List[float] = []
+        self.send_lag: List[float] = []
+
+    def add_stage(self, stage: str, ms: float) -> None:
+        self.stages.setdefault(stage, []).append(ms)
+
+    def record_sent(self, sent: float, scheduled: float) -> None:
+        with self.lock:
+            self.sent.append(sent)
+            self.send_lag.append((sent - scheduled) * 1000)
+
+    def send_rate(self) -> float:
+        # фактическая интенсивность отправки: если она ниже --rate, клиент не успевает и прогон уже не open loop
+        if len(self.sent) < 2:
+            return 0.0
+        span = max(self.sent) - min(self.sent)
+        return (len(self.sent) - 1) / span if span > 0 else 0.0
+
+    def record_ok(self, total_ms: float, body: Dict[str, Any]) -> None:
+        with self.lock:
+            self.ok += 1
+            self.add_stage("total", total_ms)
+            if isinstance(body.get("elapsed_ms"), (int, float)):
+                self.add_stage("server", float(body["elapsed_ms"]))
+            for stage, ms in (body.get("timings") or {}).items():
+                if isinstance(ms, (int, float)):
+                    self.add_stage(stage, float(ms))
+
+    def record_failure(self, message: str, timeout: bool) -> None:
+        with self.lock:
+            if timeout:
+                self.timeouts += 1
+            else:
+                self.errors += 1
+            if len(self.error_samples) < 10:
+                self.error_samples.append(message)
+
+
+def send_one(client: httpx.Client, base_url: str, question: str, scheduled: float, rec: LoadRecorder) -> None:
+    rec.record_sent(time.perf_counter(), scheduled)
+    try:
+        r = client.get(f"{base_url}/ask", params={"q": question, "timings": "true"})
+        # Задержка считается от запланированного момента отправки, чтобы очередь на клиенте не скрывала деградацию
+        total_ms = (time.perf_counter() - scheduled) * 1000
+        if r.status_code != 200:
+            rec.record_failure(f"HTTP {r.status_code}: {r.text[:200]}", timeout=False)
+            return
+        rec.record_ok(total_ms, r.json())
+    except httpx.TimeoutException as e:
+        rec.record_failure(f"timeout: {e}", timeout=True)
+    except Exception as e:
+        rec.record_failure(str(e), timeout=False)
+
+
+def run_load(
+    questions: List[str],
+    base_url: str = "http://localhost:8000",
+    concurrency: int = 8,
+    rate: float | None = None,
+    total: int | None = None,
+    timeout_s: float = 120.0,
+) -> Dict[str, Any]:
+    if not questions:
+        raise RuntimeError("Workload is empty")
+    n = total or len(questions)
+    workload = [questions[i % len(questions)] for i in range(n)]
+    rec = LoadRecorder()
+    timeout = httpx.Timeout(connect=10.0, read=timeout_s, write=timeout_s, pool=timeout_s)
+    # В open loop число запросов в полете задает сервер, а не клиент: потоков и соединений хватает на весь прогон,
+    # иначе при медленном сервере запросы ждали бы на клиенте и сервер не увидел бы заданную интенсивность
+    workers = n if rate else concurrency
+    limits = httpx.Limits(max_connections=workers, max_keepalive_connections=workers)
+
+    started = time.perf_counter()
+    with httpx.Client(timeout=timeout, limits=limits) as client, ThreadPoolExecutor(max_workers=workers) as pool:
+        if rate:
+            # open loop: фиксированная интенсивность поступления запросов, --concurrency не ограничивает
+            for i, q in enumerate(workload):
+                scheduled = started + i / rate
+                delay = scheduled - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                pool.submit(send_one, client, base_url, q, scheduled, rec)
+        else:
+            # closed loop: concurrency воркеров, каждый отправляет следующий запрос сразу после ответа
+            cursor = iter(workload)
+            cursor_lock = threading.Lock()
+
+            def worker() -> None:
+                while True:
+                    with cursor_lock:
+                        q = next(cursor, None)
+                    if q is None:
+                        return
+                    send_one(client, base_url, q, time.perf_counter(), rec)
+
+            for _ in range(concurrency):
+                pool.submit(worker)
+    duration = time.perf_counter() - started
+
+    return {
+        "base_url": base_url,
+        "mode": "open" if rate else "closed",
+        "concurrency": concurrency,
+        "rate": rate,
+        "send_rate_rps": round(rec.send_rate(), 3),
+        "requests": n,
+        "duration_s": round(duration, 3),
+        "throughput_rps": round(rec.ok / duration, 3) if duration > 0 else 0.0,
+        "ok": rec.ok,
+        "errors": rec.errors,
+        "timeouts": rec.timeouts,
+        "error_rate": rec.errors / n,
+        "timeout_rate": rec.timeouts / n,
+        "latency_ms": {stage: percentiles(values) for stage, values in rec.stages.items()},
+        # задержка фактической отправки относительно расписания (open loop)
+        "send_lag_ms": percentiles(rec.send_lag) if rate else None,
+        "error_samples": rec.error_samples,
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Нагрузочный прогон /ask")
+    parser.add_argument("--questions", type=Path, default=data_path("eval", "questions.jsonl"))
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--concurrency", type=int, default=8, help="воркеров в closed loop")
+    parser.add_argument("--rate", type=float, default=None, help="запросов в секунду (open loop)")
+    parser.add_argument("--requests", type=int, default=None, help="всего запросов (по умолчанию размер набора)")
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--out", type=Path, default=data_path("eval", "load_report.json"))
+    args = parser.parse_args()
+
+    report = run_load(
+        load_workload(args.questions),
+        base_url=args.base_url.rstrip("/"),
+        concurrency=args.concurrency,
+        rate=args.rate,
+        total=args.requests,
+        timeout_s=args.timeout,
+    )
+    report["questions"] = str(args.questions)
+    args.out.write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
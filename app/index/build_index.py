@@ -1,19 +1,43 @@
 from __future__ import annotations
-from typing import List, Dict
+from typing import Callable, List, Dict, Iterable, Iterator, Tuple
+from pathlib import Path
+import itertools
+import json
+import os
+import shutil
+import uuid
 import numpy as np
+import faiss
+import orjson
 
-from app.utils.io import data_path, read_jsonl
+from app.utils.io import data_path, iter_jsonl, ensure_dir
 from app.embed.ollama_client import OllamaClient
-from app.index.faiss_store import build_hnsw_index, save_index
+from app.index import faiss_store, reduce
+from app.index.reduce import Reducer
 from app.config import settings
 
 
-def load_chunks() -> List[Dict]:
+def iter_chunks() -> Iterator[Dict]:
     chunks_dir = data_path("chunks")
-    items: List[Dict] = []
-    for f in chunks_dir.glob("*.jsonl"):
-        items.extend(read_jsonl(f))
-    return items
+    for f in sorted(chunks_dir.glob("*.jsonl")):
+        yield from iter_jsonl(f)
+
+
+def batched(rows: Iterable[Dict], size: int) -> Iterator[List[Dict]]:
+    batch: List[Dict] = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def embed_batch(client: OllamaClient, texts: List[str]) -> np.ndarray:
+    emb = client.embed(texts)
+    emb = emb / (np.linalg.norm(emb, axis=1, keepdims=True) + 1e-12)
+    return emb.astype(np.float32)
 
 
 def embed_texts(texts: List[str], batch: int | None = None) -> np.ndarray:
@@ -21,27 +45,191 @@ def embed_texts(texts: List[str], batch: int | None = None) -> np.ndarray:
     vecs: List[np.ndarray] = []
     bsz = batch or settings.embed_batch
     for i in range(0, len(texts), bsz):
-        batch_texts = texts[i : i + bsz]
-        emb = client.embed(batch_texts)
-        emb = emb / (np.linalg.norm(emb, axis=1, keepdims=True) + 1e-12)
-        vecs.append(emb.astype(np.float32))
+        vecs.append(embed_batch(client, texts[i : i + bsz]))
     return np.vstack(vecs) if vecs else np.zeros((0, 768), dtype=np.float32)
 
 
-def build_from_chunks() -> None:
-    rows = load_chunks()
-    if not rows:
+class IndexWriter:
+    # Индексам с обучением (IVF, SQ) и PCA нужна выборка до первого add: копим первые INDEX_TRAIN_SIZE векторов
+    def __init__(self, params: Dict | None = None, reducer: Reducer | None = None) -> None:
+        self.params = params if params is not None else faiss_store.build_params()
+        self.reducer = reducer
+        self.index: faiss.Index | None = None
+        self.pending: List[np.ndarray] = []
+        self.pending_rows = 0
+
+    def _transform(self, emb: np.ndarray) -> np.ndarray:
+        return self.reducer.transform(emb) if self.reducer is not None else emb
+
+    def add(self, emb: np.ndarray) -> None:
+        if not self.pending and not (self.reducer is not None and self.reducer.needs_fit):
+            x = self._transform(emb)
+            if self.index is None:
+                self.index = faiss_store.new_index(x.shape[1], self.params)
+            if self.index.is_trained:
+                self.index.add(x)
+                return
+        self.pending.append(emb)
+        self.pending_rows += len(emb)
+        if self.pending_rows >= settings.index_train_size:
+            self._train_and_flush()
+
+    def _train_and_flush(self) -> None:
+        sample = np.vstack(self.pending)
+        if self.reducer is not None and self.reducer.needs_fit:
+            self.reducer.fit(sample)
+        x = self._transform(sample)
+        if self.index is None:
+            self.index = faiss_store.new_index(x.shape[1], self.params)
+        if not self.index.is_trained:
+            self.index.train(x)
+        self.index.add(x)
+        self.pending = []
+        self.pending_rows = 0
+
+    def finish(self) -> faiss.Index | None:
+        if self.pending:
+            self._train_and_flush()
+        return self.index
+
+
+def embedded_batches(client: OllamaClient | None = None) -> Iterator[Tuple[List[Dict], np.ndarray]]:
+    client = client or OllamaClient()
+    for batch in batched(iter_chunks(), settings.embed_batch):
+        yield batch, embed_batch(client, [r["text"] for r in batch])
+
+
+def count_chunks() -> int:
+    total = 0
+    for f in data_path("chunks").glob("*.jsonl"):
+        with f.open("rb") as fh:
+            total += sum(1 for line in fh if line.strip())
+    return total
+
+
+def embed_to_file(path: Path, should_stop: Callable[[], bool] | None = None,
+                  progress: Callable[[int], None] | None = None) -> int:
+    # Векторы дописываются в сырой float32-файл; после сбоя или отмены продолжаем с первого невстроенного чанка
+    state_path = path.with_suffix(".json")
+    done, dim = 0, None
+    if state_path.exists() and path.exists():
+        state = json.loads(state_path.read_text(encoding="utf-8"))
+        done, dim = int(state["rows"]), int(state["dim"])
+    ensure_dir(path.parent)
+    with path.open("ab") as f:
+        f.truncate(done * (dim or 0) * 4)
+        client = OllamaClient()
+        for batch in batched(itertools.islice(iter_chunks(), done, None), settings.embed_batch):
+            if should_stop is not None and should_stop():
+                break
+            emb = embed_batch(client, [r["text"] for r in batch])
+            f.write(emb.tobytes())
+            f.flush()
+            done, dim = done + len(batch), emb.shape[1]
+            # контрольная точка подменяется целиком: оборванная запись не должна сделать задание непродолжаемым
+            tmp_state = state_path.with_suffix(".json.tmp")
+            tmp_state.write_text(json.dumps({"rows": done, "dim": dim}), encoding="utf-8")
+            os.replace(tmp_state, state_path)
+            if progress is not None:
+                progress(done)
+    return done
+
+
+def staged_batches(path: Path) -> Iterator[Tuple[List[Dict], np.ndarray]]:
+    state = json.loads(path.with_suffix(".json").read_text(encoding="utf-8"))
+    rows, dim = int(state["rows"]), int(state["dim"])
+    vectors = np.memmap(path, dtype=np.float32, mode="r", shape=(rows, dim))
+    pos = 0
+    for batch in batched(itertools.islice(iter_chunks(), rows), settings.embed_batch):
+        yield batch, np.array(vectors[pos : pos + len(batch)])
+        pos += len(batch)
+    if pos != rows:
+        raise RuntimeError(f"Staged vectors ({rows}) do not match chunks ({pos}); re-run the embed stage")
+
+
+def build_from_chunks() -> int:
+    return write_index(embedded_batches())
+
+
+def write_index(batches: Iterable[Tuple[List[Dict], np.ndarray]]) -> int:
+    # Потоковая сборка: в памяти одновременно только один батч чанков, векторы сразу уходят в индекс,
+    # метаданные пишутся построчно. Файлы подменяются атомарно, поэтому сервис не увидит недостроенный индекс.
+    n_shards = max(1, settings.index_shards)
+    if n_shards == 1:
+        targets = [(faiss_store.INDEX_FILE, faiss_store.META_FILE)]
+    else:
+        targets = [faiss_store.shard_paths(k) for k in range(n_shards)]
+    for index_path, _ in targets:
+        ensure_dir(index_path.parent)
+    tmp_metas = [meta_path.with_suffix(".jsonl.tmp") for _, meta_path in targets]
+    reducer = reduce.from_settings()
+    # один reducer на все шарды: запрос сжимается одинаково для любого из них
+    writers = [IndexWriter(reducer=reducer) for _ in targets]
+    count = 0
+    meta_files = [p.open("wb") for p in tmp_metas]
+    try:
+        for batch, emb in batches:
+            # шард назначается по сквозному номеру чанка (round-robin), он же глобальный id в выдаче
+            for shard, writer in enumerate(writers):
+                rows = [i for i in range(len(batch)) if (count + i) % n_shards == shard]
+                if not rows:
+                    continue
+                writer.add(emb[rows])
+                for i in rows:
+                    r = batch[i]
+                    meta = dict(r.get("meta", {}))
+                    meta["text"] = r["text"]
+                    meta["id"] = r.get("id")
+                    if n_shards > 1:
+                        meta["_gid"] = count + i
+                    meta_files[shard].write(orjson.dumps(meta))
+                    meta_files[shard].write(b"\n")
+            count += len(batch)
+    finally:
+        for f in meta_files:
+            f.close()
+    indexes = [w.finish() for w in writers]
+    if count < n_shards or any(index is None for index in indexes):
+        for p in tmp_metas:
+            p.unlink(missing_ok=True)
         raise RuntimeError("No chunks found. Run crawler and preprocess first.")
-    texts = [r["text"] for r in rows]
-    metas = []
-    for r in rows:
-        meta = dict(r.get("meta", {}))
-        meta["text"] = r["text"]
-        meta["id"] = r.get("id")
-        metas.append(meta)
-    embeddings = embed_texts(texts)
-    index = build_hnsw_index(embeddings, m=settings.hnsw_m, ef_construction=settings.hnsw_ef_construction)
-    save_index(index, metas)
+    if reducer is not None:
+        tmp_reducer = reduce.REDUCER_FILE.with_suffix(".npz.tmp")
+        reducer.save(tmp_reducer)
+        os.replace(tmp_reducer, reduce.REDUCER_FILE)
+    else:
+        # иначе запросы продолжат сжиматься трансформацией от прошлой сборки
+        reduce.REDUCER_FILE.unlink(missing_ok=True)
+    for (index_path, meta_path), tmp_meta, index in zip(targets, tmp_metas, indexes):
+        tmp_index = index_path.with_suffix(".index.tmp")
+        faiss.write_index(index, str(tmp_index))
+        os.replace(tmp_index, index_path)
+        os.replace(tmp_meta, meta_path)
+    if n_shards > 1:
+        faiss_store.save_shards_manifest({
+            "shards": n_shards,
+            "build": uuid.uuid4().hex,
+            "assignment": "round_robin",
+            "vectors": [int(index.ntotal) for index in indexes],
+        })
+    else:
+        faiss_store.SHARDS_FILE.unlink(missing_ok=True)
+    remove_stale_layout(n_shards)
+    return count
+
+
+def remove_stale_layout(n_shards: int) -> None:
+    # Файлы другой раскладки (или лишних шардов) иначе читали бы tune, reduce и index_exists
+    keep = {faiss_store.shard_paths(k)[0].parent for k in range(n_shards)} if n_shards > 1 else set()
+    if faiss_store.SHARDS_DIR.exists():
+        for shard_dir in faiss_store.SHARDS_DIR.iterdir():
+            if shard_dir not in keep:
+                shutil.rmtree(shard_dir, ignore_errors=True)
+    if n_shards > 1:
+        for path in (faiss_store.INDEX_FILE, faiss_store.META_FILE, faiss_store.LEGACY_META_FILE):
+            path.unlink(missing_ok=True)
+    else:
+        shutil.rmtree(faiss_store.SHARDS_DIR, ignore_errors=True)
 
 
 if __name__ == "__main__":
@@ -1,40 +1,139 @@
 from __future__ import annotations
 from typing import List, Dict, Any, Tuple
 from pathlib import Path
+import json
+import os
 import numpy as np
 import faiss
 
-from app.utils.io import data_path, write_pickle, read_pickle, ensure_dir
+from app.config import settings
+from app.utils.io import data_path, read_pickle, ensure_dir, read_jsonl
 
 
 INDEX_DIR = data_path("index")
 INDEX_FILE = INDEX_DIR / "chunks.index"
-META_FILE = INDEX_DIR / "meta.pkl"
+META_FILE = INDEX_DIR / "meta.jsonl"
+# индексы, собранные до потоковой сборки, хранят метаданные в pickle
+LEGACY_META_FILE = INDEX_DIR / "meta.pkl"
+# параметры, выбранные app.index.tune; имеют приоритет над HNSW_* и TOPK из окружения
+PARAMS_FILE = INDEX_DIR / "index_params.json"
+# шардированный режим (INDEX_SHARDS > 1): по индексу и метаданным на шард плюс манифест
+SHARDS_DIR = INDEX_DIR / "shards"
+SHARDS_FILE = INDEX_DIR / "shards.json"
 
 
-def build_hnsw_index(embeddings: np.ndarray, m: int = 32, ef_construction: int = 200) -> faiss.Index:
-    dim = embeddings.shape[1]
+def new_hnsw_index(dim: int, m: int = 32, ef_construction: int = 200) -> faiss.Index:
     index = faiss.IndexHNSWFlat(dim, m, faiss.METRIC_INNER_PRODUCT)
     index.hnsw.efConstruction = ef_construction
+    return index
+
+
+def build_hnsw_index(embeddings: np.ndarray, m: int = 32, ef_construction: int = 200) -> faiss.Index:
+    index = new_hnsw_index(embeddings.shape[1], m, ef_construction)
     index.add(embeddings)
     return index
 
 
-def save_index(index: faiss.Index, metas: List[Dict[str, Any]]) -> None:
+def load_params() -> Dict[str, Any]:
+    if not PARAMS_FILE.exists():
+        return {}
+    return json.loads(PARAMS_FILE.read_text(encoding="utf-8"))
+
+
+def save_params(params: Dict[str, Any]) -> None:
     ensure_dir(INDEX_DIR)
-    faiss.write_index(index, str(INDEX_FILE))
-    write_pickle(META_FILE, metas)
-
-
-def load_index(ef_search: int = 64) -> Tuple[faiss.Index, List[Dict[str, Any]]]:
-    if not INDEX_FILE.exists() or not META_FILE.exists():
-        raise FileNotFoundError("FAISS index or meta not found")
-    index = faiss.read_index(str(INDEX_FILE))
-    try:
-        index.hnsw.efSearch = ef_search
-    except Exception:
-        pass
-    metas: List[Dict[str, Any]] = read_pickle(META_FILE)
+    PARAMS_FILE.write_text(json.dumps(params, ensure_ascii=False, indent=2), encoding="utf-8")
+
+
+def build_params() -> Dict[str, Any]:
+    params: Dict[str, Any] = {
+        "factory": f"HNSW{settings.hnsw_m},Flat",
+        "ef_construction": settings.hnsw_ef_construction,
+        "ef_search": settings.hnsw_ef_search,
+        "topk": settings.topk,
+    }
+    params.update(load_params())
+    return params
+
+
+def new_index(dim: int, params: Dict[str, Any] | None = None) -> faiss.Index:
+    params = params if params is not None else build_params()
+    index = faiss.index_factory(dim, params["factory"], faiss.METRIC_INNER_PRODUCT)
+    if hasattr(index, "hnsw") and params.get("ef_construction"):
+        index.hnsw.efConstruction = int(params["ef_construction"])
+    return index
+
+
+def apply_search_params(index: faiss.Index, params: Dict[str, Any]) -> None:
+    ps = faiss.ParameterSpace()
+    for key, name in (("ef_search", "efSearch"), ("nprobe", "nprobe")):
+        if params.get(key) is None:
+            continue
+        try:
+            ps.set_index_parameter(index, name, int(params[key]))
+        except RuntimeError:
+            pass
+
+
+def shard_paths(shard: int) -> Tuple[Path, Path]:
+    shard_dir = SHARDS_DIR / f"shard-{shard}"
+    return shard_dir / "chunks.index", shard_dir / "meta.jsonl"
+
+
+def load_shards_manifest() -> Dict[str, Any]:
+    if not SHARDS_FILE.exists():
+        return {}
+    return json.loads(SHARDS_FILE.read_text(encoding="utf-8"))
+
+
+def save_shards_manifest(manifest: Dict[str, Any]) -> None:
+    ensure_dir(INDEX_DIR)
+    # узлы шардов читают манифест при перезагрузке: подменяем файл целиком
+    tmp = SHARDS_FILE.with_suffix(".json.tmp")
+    tmp.write_text(json.dumps(manifest, ensure_ascii=False, indent=2), encoding="utf-8")
+    os.replace(tmp, SHARDS_FILE)
+
+
+def shard_count() -> int:
+    return int(load_shards_manifest().get("shards", 1))
+
+
+def index_version() -> str:
+    # меняется при каждой пересборке: build_index заменяет файлы через os.replace.
+    # Шардированная сборка несет свой id в манифесте: он совпадает и на узлах с копией data/index
+    manifest = load_shards_manifest()
+    if int(manifest.get("shards", 1)) > 1 and manifest.get("build"):
+        return str(manifest["build"])
+    path = SHARDS_FILE if int(manifest.get("shards", 1)) > 1 else INDEX_FILE
+    return str(path.stat().st_mtime_ns) if path.exists() else "none"
+
+
+def index_exists() -> bool:
+    if shard_count() > 1:
+        return all(p.exists() for k in range(shard_count()) for p in shard_paths(k))
+    return INDEX_FILE.exists() and (META_FILE.exists() or LEGACY_META_FILE.exists())
+
+
+def load_metas() -> List[Dict[str, Any]]:
+    if META_FILE.exists():
+        return read_jsonl(META_FILE)
+    return read_pickle(LEGACY_META_FILE)
+
+
+def load_index(ef_search: int = 64, shard: int | None = None) -> Tuple[faiss.Index, List[Dict[str, Any]]]:
+    if shard is None:
+        if not INDEX_FILE.exists() or not (META_FILE.exists() or LEGACY_META_FILE.exists()):
+            raise FileNotFoundError("FAISS index or meta not found")
+        index_file = INDEX_FILE
+    else:
+        index_file, meta_file = shard_paths(shard)
+        if not index_file.exists() or not meta_file.exists():
+            raise FileNotFoundError(f"FAISS shard {shard} not found")
+    index = faiss.read_index(str(index_file))
+    params = {"ef_search": ef_search}
+    params.update(load_params())
+    apply_search_params(index, params)
+    metas: List[Dict[str, Any]] = load_metas() if shard is None else read_jsonl(meta_file)
     return index, metas
 
 
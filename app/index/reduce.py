@@ -0,0 +1,161 @@
+from __future__ import annotations
+import argparse
+import json
+import time
+from pathlib import Path
+from typing import Any, Dict, List
+
+import faiss
+import numpy as np
+
+from app.config import settings
+from app.index import faiss_store
+from app.utils.io import data_path
+
+
+REDUCER_FILE = faiss_store.INDEX_DIR / "reducer.npz"
+METHODS = ("none", "pca", "matryoshka")
+
+
+def normalize(x: np.ndarray) -> np.ndarray:
+    return (x / (np.linalg.norm(x, axis=1, keepdims=True) + 1e-12)).astype(np.float32)
+
+
+class Reducer:
+    def __init__(self, method: str, dim: int, mean: np.ndarray | None = None, components: np.ndarray | None = None):
+        if method not in ("pca", "matryoshka"):
+            raise ValueError(f"Unknown reduction method: {method}")
+        self.method = method
+        self.dim = dim
+        self.mean = mean
+        self.components = components
+
+    @property
+    def needs_fit(self) -> bool:
+        return self.method == "pca" and self.components is None
+
+    def fit(self, sample: np.ndarray) -> "Reducer":
+        if self.method == "pca":
+            from sklearn.decomposition import PCA
+
+            dim = min(self.dim, sample.shape[0], sample.shape[1])
+            pca = PCA(n_components=dim, svd_solver="auto", random_state=0).fit(sample)
+            self.dim = dim
+            self.mean = pca.mean_.astype(np.float32)
+            self.components = pca.components_.astype(np.float32)
+        return self
+
+    def transform(self, x: np.ndarray) -> np.ndarray:
+        if self.method == "matryoshka":
+            # nomic-embed-text обучена с Matryoshka loss: первые d компонент сами по себе являются эмбеддингом
+            return normalize(x[:, : self.dim])
+        assert self.mean is not None and self.components is not None, "PCA reducer is not fitted"
+        return normalize((x - self.mean) @ self.components.T)
+
+    def save(self, path: Path = REDUCER_FILE) -> None:
+        # np.savez сам добавляет .npz к имени без этого суффикса, поэтому пишем через файловый объект
+        with path.open("wb") as f:
+            np.savez(
+                f,
+                method=np.array(self.method),
+                dim=np.array(self.dim),
+                mean=self.mean if self.mean is not None else np.zeros(0, np.float32),
+                components=self.components if self.components is not None else np.zeros((0, 0), np.float32),
+            )
+
+    @classmethod
+    def load(cls, path: Path = REDUCER_FILE) -> "Reducer | None":
+        if not path.exists():
+            return None
+        data = np.load(path)
+        method = str(data["method"])
+        mean = data["mean"] if data["mean"].size else None
+        components = data["components"] if data["components"].size else None
+        return cls(method, int(data["dim"]), mean, components)
+
+
+def from_settings() -> Reducer | None:
+    if settings.embed_reduce == "none":
+        return None
+    return Reducer(settings.embed_reduce, settings.embed_reduce_dim)
+
+
+def url_recall(ids: np.ndarray, metas: List[Dict[str, Any]], urls: List[str | None], k: int = 3) -> float | None:
+    pairs = [(row, url) for row, url in zip(ids, urls) if url]
+    if not pairs:
+        return None
+    hit = 0
+    for row, url in pairs:
+        if any(0 <= i < len(metas) and str(metas[i].get("url") or "").startswith(url) for i in row[:k]):
+            hit += 1
+    return hit / len(pairs)
+
+
+def report(questions: Path, dims: List[int], pca_sample: int) -> Dict[str, Any]:
+    from app.embed.ollama_client import OllamaClient
+    from app.index.build_index import embed_texts
+    from app.index.tune import load_eval_queries, load_vectors, recall_at
+
+    index, metas = faiss_store.load_index(settings.hnsw_ef_search)
+    # для сравнения нужны исходные векторы: если индекс уже сжат, эмбеддим корпус заново
+    if Reducer.load() is None:
+        xb = load_vectors(index, metas)
+    else:
+        xb = embed_texts([m["text"] for m in metas])
+    eval_questions, eval_urls = load_eval_queries(questions)
+    xq = normalize(OllamaClient().embed(eval_questions))
+
+    exact = faiss.IndexFlatIP(xb.shape[1])
+    exact.add(xb)
+    _, exact_ids = exact.search(xq, 3)
+
+    params = faiss_store.build_params()
+    rows: List[Dict[str, Any]] = []
+    variants = [("none", xb.shape[1])] + [(m, d) for m in ("pca", "matryoshka") for d in dims if d < xb.shape[1]]
+    for method, dim in variants:
+        t0 = time.perf_counter()
+        if method == "none":
+            xb_r, xq_r = xb, xq
+        else:
+            reducer = Reducer(method, dim)
+            if reducer.needs_fit:
+                reducer.fit(xb[:pca_sample])
+            xb_r, xq_r = reducer.transform(xb), reducer.transform(xq)
+        red = faiss_store.new_index(xb_r.shape[1], params)
+        if not red.is_trained:
+            red.train(xb_r)
+        red.add(xb_r)
+        faiss_store.apply_search_params(red, params)
+        build_s = time.perf_counter() - t0
+        ids = np.empty((len(xq_r), 3), dtype=np.int64)
+        t1 = time.perf_counter()
+        for i in range(len(xq_r)):
+            _, ids[i] = faiss_store.search(red, xq_r[i : i + 1], 3)
+        latency_ms = (time.perf_counter() - t1) * 1000 / max(1, len(xq_r))
+        rows.append({
+            "method": method,
+            "dim": int(xb_r.shape[1]),
+            "index_bytes": len(faiss.serialize_index(red)),
+            "search_ms": round(latency_ms, 4),
+            "build_s": round(build_s, 3),
+            "recall@3": url_recall(ids, metas, eval_urls, 3),
+            "overlap@3_vs_full": round(recall_at(ids, exact_ids, 3), 4) if len(xq_r) else None,
+        })
+    return {"vectors": int(len(xb)), "queries": len(eval_questions), "factory": params["factory"], "variants": rows}
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Влияние снижения размерности на размер индекса, скорость и recall@3")
+    parser.add_argument("--questions", type=Path, default=data_path("eval", "questions.jsonl"))
+    parser.add_argument("--dims", default="64,128,256,384")
+    parser.add_argument("--pca-sample", type=int, default=settings.index_train_size)
+    parser.add_argument("--out", type=Path, default=data_path("eval", "reduce_report.json"))
+    args = parser.parse_args()
+    result = report(args.questions, [int(d) for d in args.dims.split(",") if d], args.pca_sample)
+    args.out.write_text(json.dumps(result, ensure_ascii=False, indent=2), encoding="utf-8")
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
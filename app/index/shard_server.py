@@ -0,0 +1,121 @@
+from __future__ import annotations
+import argparse
+import os
+import threading
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, List, Tuple
+
+import numpy as np
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import ORJSONResponse
+from pydantic import BaseModel, Field
+
+from app.config import settings
+from app.index import faiss_store
+
+SHARD_ID = int(os.environ.get("SHARD_ID", "0"))
+# Узел держит текущую и предыдущую сборки: запросы со снимка до перезагрузки называют свою сборку
+# и дорабатывают на ней, а не на новых данных со старым reducer
+KEEP_BUILDS = 2
+_builds: "OrderedDict[str, Tuple[Any, List[Dict[str, Any]]]]" = OrderedDict()
+_builds_lock = threading.Lock()
+
+
+def load() -> str:
+    while True:
+        build = faiss_store.index_version()
+        with _builds_lock:
+            if build in _builds:
+                _builds.move_to_end(build)
+                return build
+        loaded = faiss_store.load_index(settings.hnsw_ef_search, shard=SHARD_ID)
+        # манифест сменился, пока читался шард: файлы могут быть уже от следующей сборки
+        if faiss_store.index_version() != build:
+            continue
+        with _builds_lock:
+            _builds[build] = loaded
+            _builds.move_to_end(build)
+            while len(_builds) > KEEP_BUILDS:
+                _builds.popitem(last=False)
+        return build
+
+
+def latest() -> Tuple[str, Tuple[Any, List[Dict[str, Any]]]]:
+    with _builds_lock:
+        build = next(reversed(_builds))
+        return build, _builds[build]
+
+
+@asynccontextmanager
+async def lifespan(_: FastAPI) -> AsyncIterator[None]:
+    load()
+    yield
+
+
+app = FastAPI(default_response_class=ORJSONResponse, title=f"K-RAG shard {SHARD_ID}", lifespan=lifespan)
+
+
+class ShardSearchRequest(BaseModel):
+    vectors: List[List[float]] = Field(..., min_length=1)
+    topk: int = Field(15, ge=1, le=1000)
+    # сборка, из которой отвечать; без нее — последняя загруженная
+    build: str | None = None
+
+
+@app.get("/health")
+def health() -> Dict[str, Any]:
+    build, (index, _) = latest()
+    with _builds_lock:
+        builds = list(_builds)
+    return {"status": "ok", "shard": SHARD_ID, "build": build, "builds": builds, "vectors": int(index.ntotal)}
+
+
+@app.post("/reload")
+def reload() -> Dict[str, Any]:
+    load()
+    return health()
+
+
+@app.post("/search")
+def search(req: ShardSearchRequest) -> Dict[str, Any]:
+    if req.build is None:
+        _, (index, metas) = latest()
+    else:
+        with _builds_lock:
+            loaded = _builds.get(req.build)
+        if loaded is None:
+            raise HTTPException(status_code=409, detail=f"Build {req.build} is no longer loaded on shard {SHARD_ID}")
+        index, metas = loaded
+    qv = np.asarray(req.vectors, dtype=np.float32)
+    if qv.ndim != 2 or qv.shape[1] != index.d:
+        raise HTTPException(status_code=422, detail=f"Expected vectors of dim {index.d}")
+    sims, ids = faiss_store.search(index, qv, min(req.topk, int(index.ntotal)))
+    results: List[List[Dict[str, Any]]] = []
+    for row_sims, row_ids in zip(sims.tolist(), ids.tolist()):
+        hits: List[Dict[str, Any]] = []
+        for sim, idx in zip(row_sims, row_ids):
+            if idx < 0 or idx >= len(metas):
+                continue
+            meta = dict(metas[idx])
+            meta["_sim"] = float(sim)
+            hits.append(meta)
+        results.append(hits)
+    return {"shard": SHARD_ID, "results": results}
+
+
+def main() -> int:
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Процесс, обслуживающий один шард FAISS-индекса")
+    parser.add_argument("--shard", type=int, required=True)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=None)
+    args = parser.parse_args()
+    os.environ["SHARD_ID"] = str(args.shard)
+    uvicorn.run("app.index.shard_server:app", host=args.host, port=args.port or settings.shard_base_port + args.shard)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
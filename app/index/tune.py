@@ -0,0 +1,227 @@
+from __future__ import annotations
+import argparse
+import json
+import os
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+
+import faiss
+import numpy as np
+
+from app.config import settings
+from app.index import faiss_store
+from app.index.reduce import Reducer, normalize, url_recall
+from app.utils.io import data_path
+
+
+HNSW_M = [16, 32, 48]
+HNSW_EF_CONSTRUCTION = [100, 200, 400]
+HNSW_EF_SEARCH = [16, 32, 64, 128, 256]
+IVF_NPROBE = [1, 4, 16, 64]
+TOPK_GRID = [5, 10, 15, 20, 30]
+
+
+def exact_storage(index: faiss.Index) -> bool:
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexHNSW):
+        index = faiss.downcast_index(index.storage)
+    return isinstance(index, (faiss.IndexFlat, faiss.IndexIVFFlat))
+
+
+def load_vectors(index: faiss.Index, metas: List[Dict[str, Any]], reducer: Reducer | None = None) -> np.ndarray:
+    # SQ/PQ восстанавливают векторы с потерями: повторный тюнинг с --apply копил бы ошибку квантования
+    if exact_storage(index):
+        try:
+            return index.reconstruct_n(0, index.ntotal).astype(np.float32)
+        except RuntimeError:
+            pass
+    from app.index.build_index import embed_texts
+    xb = embed_texts([m["text"] for m in metas])
+    # индекс собран в пространстве reducer.npz: заново встроенные векторы приводим к нему же
+    return reducer.transform(xb) if reducer is not None else xb
+
+
+def load_eval_queries(path: Path) -> Tuple[List[str], List[str | None]]:
+    from app.eval.run_eval_sequential import load_questions
+
+    rows = load_questions(path)
+    return [r["question"] for r in rows], [r.get("url") or r.get("source_url") for r in rows]
+
+
+def synthetic_queries(xb: np.ndarray, n: int, noise: float, seed: int = 0) -> np.ndarray:
+    # Вопросов в eval мало: для устойчивой оценки recall добавляем зашумленные векторы корпуса
+    rng = np.random.default_rng(seed)
+    picks = xb[rng.integers(0, len(xb), size=n)]
+    q = picks + noise * rng.standard_normal(picks.shape).astype(np.float32)
+    return (q / (np.linalg.norm(q, axis=1, keepdims=True) + 1e-12)).astype(np.float32)
+
+
+def candidate_configs(n: int) -> List[Dict[str, Any]]:
+    configs: List[Dict[str, Any]] = [{"factory": "Flat"}]
+    for m in HNSW_M:
+        for efc in HNSW_EF_CONSTRUCTION:
+            for efs in HNSW_EF_SEARCH:
+                configs.append({"factory": f"HNSW{m},Flat", "ef_construction": efc, "ef_search": efs})
+        for efs in HNSW_EF_SEARCH:
+            configs.append({"factory": f"HNSW{m},SQ8", "ef_construction": 200, "ef_search": efs})
+    # IVF имеет смысл, когда на каждый кластер приходится хотя бы ~39 векторов
+    for nlist in sorted({max(1, int(np.sqrt(n))), max(1, int(4 * np.sqrt(n)))}):
+        if n < 39 * nlist:
+            continue
+        for nprobe in IVF_NPROBE:
+            if nprobe <= nlist:
+                configs.append({"factory": f"IVF{nlist},Flat", "nprobe": nprobe})
+    return configs
+
+
+def build_for(xb: np.ndarray, params: Dict[str, Any], cache: Dict[Tuple, Tuple[faiss.Index, float, int]]):
+    key = (params["factory"], params.get("ef_construction"))
+    if key not in cache:
+        t0 = time.perf_counter()
+        index = faiss_store.new_index(xb.shape[1], params)
+        if not index.is_trained:
+            index.train(xb)
+        index.add(xb)
+        build_s = time.perf_counter() - t0
+        cache.clear()
+        cache[key] = (index, build_s, len(faiss.serialize_index(index)))
+    return cache[key]
+
+
+def recall_at(ann_ids: np.ndarray, exact_ids: np.ndarray, k: int) -> float:
+    hits = 0
+    for a, e in zip(ann_ids[:, :k], exact_ids[:, :k]):
+        hits += len(set(a.tolist()) & set(e.tolist()))
+    return hits / (k * len(exact_ids))
+
+
+def measure(index: faiss.Index, xq: np.ndarray, k: int) -> Tuple[np.ndarray, float]:
+    ids = np.empty((len(xq), k), dtype=np.int64)
+    t0 = time.perf_counter()
+    # по одному запросу, как в /ask
+    for i in range(len(xq)):
+        _, ids[i] = faiss_store.search(index, xq[i : i + 1], k)
+    return ids, (time.perf_counter() - t0) * 1000 / len(xq)
+
+
+def pareto_front(results: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    def dominates(a: Dict[str, Any], b: Dict[str, Any]) -> bool:
+        better_or_equal = (a["latency_ms"] <= b["latency_ms"] and a["recall"] >= b["recall"]
+                           and a["memory_bytes"] <= b["memory_bytes"])
+        strictly = (a["latency_ms"] < b["latency_ms"] or a["recall"] > b["recall"]
+                    or a["memory_bytes"] < b["memory_bytes"])
+        return better_or_equal and strictly
+
+    return [r for r in results if not any(dominates(o, r) for o in results if o is not r)]
+
+
+def choose(front: List[Dict[str, Any]], target_recall: float) -> Dict[str, Any]:
+    good = [r for r in front if r["recall"] >= target_recall]
+    if good:
+        return min(good, key=lambda r: (r["latency_ms"], r["memory_bytes"]))
+    return max(front, key=lambda r: (r["recall"], -r["latency_ms"]))
+
+
+def choose_topk(metas: List[Dict[str, Any]], exact_ids: np.ndarray, urls: List[str | None]) -> Tuple[int | None, Dict[int, float]]:
+    # Наименьший topk, при котором ожидаемый URL попадает в кандидатов так же часто, как при максимальном
+    rates: Dict[int, float] = {}
+    for k in TOPK_GRID:
+        rate = url_recall(exact_ids, metas, urls, k)
+        if rate is None:
+            return None, {}
+        rates[k] = rate
+    best = max(rates.values())
+    return min(k for k, r in rates.items() if r == best), rates
+
+
+def tune(questions: Path, synthetic: int, noise: float, target_recall: float,
+         k: int) -> Tuple[Dict[str, Any], np.ndarray]:
+    from app.embed.ollama_client import OllamaClient
+
+    if faiss_store.shard_count() > 1:
+        raise RuntimeError("Tuning supports the single-index layout only; rebuild with INDEX_SHARDS=1 first")
+    index, metas = faiss_store.load_index(settings.hnsw_ef_search)
+    reducer = Reducer.load()
+    xb = load_vectors(index, metas, reducer)
+    eval_questions, eval_urls = load_eval_queries(questions)
+    xq_eval = np.zeros((0, xb.shape[1]), np.float32)
+    if eval_questions:
+        xq_eval = normalize(OllamaClient().embed(eval_questions))
+        if reducer is not None:
+            xq_eval = reducer.transform(xq_eval)
+    xq = np.vstack([xq_eval, synthetic_queries(xb, synthetic, noise)]) if synthetic else xq_eval
+
+    kmax = min(max(TOPK_GRID + [k]), len(xb))
+    k = min(k, len(xb))
+    exact = faiss.IndexFlatIP(xb.shape[1])
+    exact.add(xb)
+    _, exact_ids = exact.search(xq, kmax)
+
+    results: List[Dict[str, Any]] = []
+    cache: Dict[Tuple, Tuple[faiss.Index, float, int]] = {}
+    for params in candidate_configs(len(xb)):
+        built, build_s, size = build_for(xb, params, cache)
+        faiss_store.apply_search_params(built, params)
+        ids, latency_ms = measure(built, xq, k)
+        results.append({
+            **params,
+            "recall": round(recall_at(ids, exact_ids, k), 4),
+            "latency_ms": round(latency_ms, 4),
+            "memory_bytes": size,
+            "build_s": round(build_s, 3),
+        })
+
+    front = sorted(pareto_front(results), key=lambda r: r["latency_ms"])
+    chosen = choose(front, target_recall)
+    topk, topk_rates = choose_topk(metas, exact_ids[: len(eval_questions)], eval_urls)
+    return {
+        "vectors": int(len(xb)),
+        "queries": int(len(xq)),
+        "k": k,
+        "target_recall": target_recall,
+        "chosen": chosen,
+        "topk": topk,
+        "topk_url_hit_rate": topk_rates,
+        "pareto_front": front,
+        "results": results,
+    }, xb
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Подбор параметров ANN-индекса по eval-набору")
+    parser.add_argument("--questions", type=Path, default=data_path("eval", "questions.jsonl"))
+    parser.add_argument("--synthetic-queries", type=int, default=200)
+    parser.add_argument("--noise", type=float, default=0.05)
+    parser.add_argument("--target-recall", type=float, default=0.95)
+    parser.add_argument("--k", type=int, default=settings.topk, help="глубина, на которой считается recall ANN")
+    parser.add_argument("--dry-run", action="store_true", help="только отчет, без записи index_params.json")
+    parser.add_argument("--apply", action="store_true", help="сразу пересобрать индекс с выбранными параметрами")
+    parser.add_argument("--out", type=Path, default=data_path("eval", "tune_report.json"))
+    args = parser.parse_args()
+
+    # векторы корпуса нужны для --apply, в отчет они не попадают
+    report, xb = tune(args.questions, args.synthetic_queries, args.noise, args.target_recall, args.k)
+    args.out.write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+
+    chosen = report["chosen"]
+    params = {key: chosen[key] for key in ("factory", "ef_construction", "ef_search", "nprobe") if key in chosen}
+    params["topk"] = report["topk"] or settings.topk
+    print(json.dumps({"chosen": chosen, "topk": params["topk"], "pareto_front": report["pareto_front"]},
+                     ensure_ascii=False, indent=2))
+    if args.dry_run:
+        return 0
+    faiss_store.save_params(params)
+    if args.apply:
+        index = faiss_store.new_index(xb.shape[1], params)
+        if not index.is_trained:
+            index.train(xb)
+        index.add(xb)
+        tmp_index = faiss_store.INDEX_FILE.with_suffix(".index.tmp")
+        faiss.write_index(index, str(tmp_index))
+        os.replace(tmp_index, faiss_store.INDEX_FILE)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,353 @@
+from __future__ import annotations
+import fcntl
+import json
+import os
+import queue
+import shutil
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Sequence
+
+from app.config import settings
+from app.utils.io import data_path, ensure_dir
+
+
+STAGES = ("crawl", "preprocess", "embed", "index")
+ACTIVE = ("queued", "running")
+RESUMABLE = ("failed", "cancelled", "interrupted")
+JOBS_DIR = data_path("jobs")
+LOCK_FILE = JOBS_DIR / ".lock"
+
+
+class JobConflict(RuntimeError):
+    def __init__(self, job_id: str) -> None:
+        super().__init__(f"Ingestion job {job_id} is already active")
+        self.job_id = job_id
+
+
+class JobCancelled(Exception):
+    pass
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat(timespec="seconds")
+
+
+def job_dir(job_id: str) -> Path:
+    return JOBS_DIR / job_id
+
+
+def staging_vectors(job_id: str) -> Path:
+    return job_dir(job_id) / "staging" / "vectors.f32"
+
+
+def cancel_marker(job_id: str) -> Path:
+    return job_dir(job_id) / "cancel"
+
+
+def read_job(job_id: str) -> Dict[str, Any] | None:
+    path = job_dir(job_id) / "job.json"
+    if not path.exists():
+        return None
+    job = json.loads(path.read_text(encoding="utf-8"))
+    if job["status"] in ACTIVE and cancel_marker(job_id).exists():
+        job["cancel_requested"] = True
+    return job
+
+
+def read_jobs() -> Dict[str, Dict[str, Any]]:
+    jobs: Dict[str, Dict[str, Any]] = {}
+    for path in sorted(JOBS_DIR.glob("*/job.json")):
+        job = read_job(path.parent.name)
+        if job is not None:
+            jobs[job["id"]] = job
+    return jobs
+
+
+def chunks_fingerprint() -> List[List[Any]]:
+    # по размеру и mtime файлов чанков видно, что препроцессинг перезапускался после начала эмбеддинга
+    files = sorted(data_path("chunks").glob("*.jsonl"))
+    return [[f.name, f.stat().st_size, f.stat().st_mtime_ns] for f in files]
+
+
+def run_crawl(job: Dict[str, Any], stage: Dict[str, Any], should_stop: Callable[[], bool]) -> Dict[str, Any]:
+    from app.crawler import crawl
+
+    pages = crawl.run()
+    if not pages:
+        raise RuntimeError("Crawler fetched no pages")
+    return {"pages": len(pages)}
+
+
+def run_preprocess(job: Dict[str, Any], stage: Dict[str, Any], should_stop: Callable[[], bool]) -> Dict[str, Any]:
+    from app.preprocess import clean_and_chunk
+
+    rows = clean_and_chunk.process_raw_to_chunks()
+    if not rows:
+        raise RuntimeError("Preprocessing produced no chunks")
+    return {"chunks": len(rows)}
+
+
+def run_embed(job: Dict[str, Any], stage: Dict[str, Any], should_stop: Callable[[], bool],
+              progress: Callable[[Dict[str, Any]], None]) -> Dict[str, Any]:
+    from app.index.build_index import count_chunks, embed_to_file
+
+    path = staging_vectors(job["id"])
+    fingerprint = chunks_fingerprint()
+    if stage.get("progress", {}).get("fingerprint") != fingerprint:
+        # чанки поменялись: частично встроенные векторы к ним уже не относятся
+        shutil.rmtree(path.parent, ignore_errors=True)
+    total = count_chunks()
+    if not total:
+        raise RuntimeError("No chunks found. Run crawler and preprocess first.")
+    progress({"rows": 0, "total": total, "fingerprint": fingerprint})
+    done = embed_to_file(path, should_stop=should_stop,
+                         progress=lambda n: progress({"rows": n, "total": total, "fingerprint": fingerprint}))
+    if done < total:
+        raise JobCancelled()
+    return {"vectors": done}
+
+
+def run_index(job: Dict[str, Any], stage: Dict[str, Any], should_stop: Callable[[], bool]) -> Dict[str, Any]:
+    from app.index.build_index import staged_batches, write_index
+    from app.pipeline import reload_index
+
+    path = staging_vectors(job["id"])
+    if not path.exists():
+        raise RuntimeError("No staged vectors; the embed stage has to run first")
+    embed = next((s for s in job["stages"] if s["name"] == "embed"), None)
+    if embed is not None and embed.get("progress", {}).get("fingerprint") != chunks_fingerprint():
+        # препроцессинг перезапускали после эмбеддинга: векторы легли бы не на свои чанки
+        embed["state"] = "pending"
+        raise RuntimeError("Chunks changed after the embed stage; resume the job to re-embed")
+    count = write_index(staged_batches(path))
+    reload_index()
+    shutil.rmtree(path.parent, ignore_errors=True)
+    return {"vectors": count}
+
+
+class IngestRunner:
+    # Задания выполняются строго по одному: этапы пишут в общие data/raw, data/chunks и data/index.
+    # Эксклюзивный flock на data/jobs/.lock держится, пока задание в очереди или выполняется, поэтому
+    # API и app.cli.bootstrap не запустят параллельные прогоны. Состояние заданий читается с диска.
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.lock_fd: int | None = None
+        self.current: Dict[str, Any] | None = None
+        self.queue: "queue.Queue[str]" = queue.Queue()
+        self.thread: threading.Thread | None = None
+
+    def _try_lock(self) -> bool:
+        ensure_dir(JOBS_DIR)
+        fd = os.open(LOCK_FILE, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return False
+        os.ftruncate(fd, 0)
+        os.write(fd, str(os.getpid()).encode())
+        self.lock_fd = fd
+        return True
+
+    def _unlock(self) -> None:
+        fd, self.lock_fd = self.lock_fd, None
+        if fd is not None:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
+
+    def _mark_interrupted(self, jobs: Dict[str, Dict[str, Any]]) -> None:
+        # Вызывается только под flock: раз блокировка свободна, процесс-владелец активного задания уже завершился
+        for job in jobs.values():
+            if job["status"] not in ACTIVE:
+                continue
+            job["status"] = "interrupted"
+            for stage in job["stages"]:
+                if stage["state"] == "running":
+                    stage["state"] = "pending"
+            self._save(job)
+
+    def _jobs(self) -> Dict[str, Dict[str, Any]]:
+        jobs = read_jobs()
+        if any(j["status"] in ACTIVE for j in jobs.values()) and self.lock_fd is None and self._try_lock():
+            try:
+                self._mark_interrupted(jobs)
+            finally:
+                self._unlock()
+        return jobs
+
+    def _acquire(self) -> None:
+        if self.lock_fd is not None or not self._try_lock():
+            active = next((j for j in read_jobs().values() if j["status"] in ACTIVE), None)
+            raise JobConflict(active["id"] if active else "unknown")
+        self._mark_interrupted(read_jobs())
+
+    def _save(self, job: Dict[str, Any]) -> None:
+        job["updated_at"] = _now()
+        path = job_dir(job["id"]) / "job.json"
+        ensure_dir(path.parent)
+        tmp = path.with_suffix(".json.tmp")
+        tmp.write_text(json.dumps(job, ensure_ascii=False, indent=2), encoding="utf-8")
+        os.replace(tmp, path)
+
+    def _update(self, job: Dict[str, Any], stage: Dict[str, Any] | None = None, **fields: Any) -> None:
+        with self.lock:
+            (stage if stage is not None else job).update(fields)
+            self._save(job)
+
+    def _start_worker(self) -> None:
+        if self.thread is None or not self.thread.is_alive():
+            self.thread = threading.Thread(target=self._worker, name="ingest", daemon=True)
+            self.thread.start()
+
+    def _worker(self) -> None:
+        while True:
+            self.queue.get()
+            self.execute()
+
+    def submit(self, stages: Sequence[str] | None = None, background: bool = True) -> Dict[str, Any]:
+        stages = list(stages or STAGES)
+        unknown = [s for s in stages if s not in STAGES]
+        if unknown or not stages:
+            raise ValueError(f"Unknown stages {unknown}; expected a subset of {list(STAGES)}")
+        if ("embed" in stages) != ("index" in stages):
+            # векторы складываются в staging самого задания: index без embed нечего собирать,
+            # а embed без index оставил бы векторы, которые не подхватит ни одно следующее задание
+            raise ValueError("Stages 'embed' and 'index' have to run in the same job")
+        with self.lock:
+            self._acquire()
+            job_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:6]}"
+            job = {
+                "id": job_id,
+                "status": "queued",
+                "pid": os.getpid(),
+                "created_at": _now(),
+                "finished_at": None,
+                "error": None,
+                "cancel_requested": False,
+                "stages": [{"name": s, "state": "pending"} for s in STAGES if s in stages],
+            }
+            self.current = job
+            self._save(job)
+        return self._dispatch(job_id, background)
+
+    def resume(self, job_id: str, background: bool = True) -> Dict[str, Any]:
+        with self.lock:
+            if read_job(job_id) is None:
+                raise KeyError(job_id)
+            self._acquire()
+            job = read_job(job_id)
+            assert job is not None
+            if job["status"] not in RESUMABLE:
+                self._unlock()
+                raise ValueError(f"Job {job_id} is {job['status']}, only {list(RESUMABLE)} jobs can be resumed")
+            cancel_marker(job_id).unlink(missing_ok=True)
+            job.update(status="queued", pid=os.getpid(), error=None, finished_at=None, cancel_requested=False)
+            self.current = job
+            self._save(job)
+        return self._dispatch(job_id, background)
+
+    def _dispatch(self, job_id: str, background: bool) -> Dict[str, Any]:
+        if background:
+            self._start_worker()
+            self.queue.put(job_id)
+        else:
+            self.execute()
+        return self.get(job_id)
+
+    def cancel(self, job_id: str) -> Dict[str, Any]:
+        with self.lock:
+            job = self._jobs().get(job_id)
+            if job is None:
+                raise KeyError(job_id)
+            if job["status"] in ACTIVE:
+                # выполняющийся этап останавливается на ближайшей контрольной точке (между батчами эмбеддинга
+                # или по окончании краулинга/препроцессинга); метка на диске видна и заданию другого процесса
+                cancel_marker(job_id).touch()
+                job["cancel_requested"] = True
+        return job
+
+    def _should_stop(self, job: Dict[str, Any]) -> bool:
+        if cancel_marker(job["id"]).exists():
+            job["cancel_requested"] = True
+            return True
+        return False
+
+    def execute(self) -> None:
+        job = self.current
+        assert job is not None
+        try:
+            self._run(job)
+        finally:
+            with self.lock:
+                cancel_marker(job["id"]).unlink(missing_ok=True)
+                self.current = None
+                self._unlock()
+
+    def _run(self, job: Dict[str, Any]) -> None:
+        def should_stop() -> bool:
+            return self._should_stop(job)
+
+        if should_stop():
+            self._update(job, status="cancelled", finished_at=_now())
+            return
+        self._update(job, status="running")
+        for stage in job["stages"]:
+            if stage["state"] == "done":
+                continue
+            if should_stop():
+                self._update(job, status="cancelled", finished_at=_now())
+                return
+            t0 = time.perf_counter()
+            self._update(job, stage, state="running", started_at=_now(), error=None)
+            try:
+                if stage["name"] == "embed":
+                    result = run_embed(job, stage, should_stop, lambda p: self._update(job, stage, progress=p))
+                else:
+                    fn = {"crawl": run_crawl, "preprocess": run_preprocess, "index": run_index}[stage["name"]]
+                    result = fn(job, stage, should_stop)
+            except JobCancelled:
+                self._update(job, stage, state="pending", seconds=round(time.perf_counter() - t0, 3))
+                self._update(job, status="cancelled", finished_at=_now())
+                return
+            except Exception as e:
+                self._update(job, stage, state="failed", error=str(e), seconds=round(time.perf_counter() - t0, 3))
+                self._update(job, status="failed", error=f"{stage['name']}: {e}", finished_at=_now())
+                return
+            self._update(job, stage, state="done", result=result, finished_at=_now(),
+                         seconds=round(time.perf_counter() - t0, 3))
+        self._update(job, status="succeeded", finished_at=_now())
+
+    def get(self, job_id: str) -> Dict[str, Any]:
+        with self.lock:
+            job = self._jobs().get(job_id)
+        if job is None:
+            raise KeyError(job_id)
+        return job
+
+    def list_jobs(self, limit: int = 20) -> List[Dict[str, Any]]:
+        with self.lock:
+            jobs = self._jobs()
+        return [jobs[i] for i in sorted(jobs, reverse=True)[:limit]]
+
+    def ensure_index(self) -> None:
+        # Нет индекса: продолжаем последнее прерванное или упавшее задание с его этапа, иначе запускаем
+        # полный прогон в фоне; отмененное вручную задание заново не стартуем
+        from app.index.faiss_store import index_exists
+
+        if not settings.ingest_auto_bootstrap or index_exists():
+            return
+        latest = next(iter(self.list_jobs(1)), None)
+        try:
+            if latest is not None and latest["status"] in ("interrupted", "failed"):
+                self.resume(latest["id"])
+            elif latest is None or latest["status"] == "succeeded":
+                self.submit()
+        except JobConflict:
+            pass
+
+
+runner = IngestRunner()
@@ -1,28 +1,25 @@
 from __future__ import annotations
 from typing import List, Dict, Tuple
 import os
+import threading
 from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 
 from app.retrieval.retrieve import Retriever
 from app.generation.generate import generate_answer
-from app.index.faiss_store import INDEX_FILE, META_FILE
 from app.config import settings
+from app.utils.metrics import stage_timer
+from app.utils.singleflight import SingleFlight
 
 
-class Pipeline:
-    def __init__(self, auto_bootstrap: bool = True):
-        if auto_bootstrap and not (INDEX_FILE.exists() and META_FILE.exists()):
-            self.bootstrap()
-        self.retriever = Retriever()
+def normalize_question(question: str) -> str:
+    return " ".join(question.lower().split())
 
-    def bootstrap(self) -> None:
-        from app.crawler import crawl
-        from app.preprocess import clean_and_chunk
-        from app.index import build_index
 
-        crawl.run()
-        clean_and_chunk.process_raw_to_chunks()
-        build_index.build_from_chunks()
+class Pipeline:
+    def __init__(self):
+        self.retriever = Retriever()
+        self._inflight = SingleFlight("ask")
 
     def _filter_by_majority_product(self, hits: List[Dict]) -> List[Dict]:
         if not hits:
@@ -34,12 +31,94 @@ class Pipeline:
         majority, _ = Counter(products).most_common(1)[0]
         return [h for h in hits if (h.get("product") or h.get("meta", {}).get("product")) == majority]
 
-    def ask(self, question: str) -> Tuple[str, List[Dict], List[int]]:
-        hits, _ = self.retriever.ann_search(question, topk=settings.topk)
-        reranked = self.retriever.rerank(question, hits, topn=settings.topn_context)
-        reranked = self._filter_by_majority_product(reranked)
+    def ask(self, question: str, timings: Dict[str, float] | None = None) -> Tuple[str, List[Dict], List[int]]:
+        if not settings.coalesce_requests:
+            return self._ask(question, timings)
+        # Всплеск одинаковых вопросов: считаем один раз, остальные ждут и получают тот же ответ
+        key = (normalize_question(question), self.retriever.index_version())
+        (result, stage_timings), _ = self._inflight.do(key, lambda: self._ask_timed(question))
+        if timings is not None:
+            timings.update(stage_timings)
+        return result
+
+    def _ask_timed(self, question: str) -> Tuple[Tuple[str, List[Dict], List[int]], Dict[str, float]]:
+        # тайминги ведущего возвращаются вместе с ответом, чтобы их получили и присоединившиеся запросы
+        stage_timings: Dict[str, float] = {}
+        return self._ask(question, stage_timings), stage_timings
+
+    def _ask(self, question: str, timings: Dict[str, float] | None = None) -> Tuple[str, List[Dict], List[int]]:
+        hits, _ = self.retriever.ann_search(question, timings=timings)
+        reranked = self.retriever.rerank(question, hits, topn=settings.topn_context, timings=timings)
+        with stage_timer("filter", timings):
+            reranked = self._filter_by_majority_product(reranked)
         contexts = reranked
-        answer = generate_answer(question, contexts)
+        with stage_timer("generate", timings):
+            answer = generate_answer(question, contexts)
+        sources, used_ids = self._sources(contexts)
+        return answer, sources, used_ids
+
+    def ask_batch(self, questions: List[str], timings: Dict[str, float] | None = None,
+                  return_exceptions: bool = False) -> List[Tuple[str, List[Dict], List[int]] | Exception]:
+        hits_lists, _ = self.retriever.ann_search_batch(questions, timings=timings)
+        reranked = self.retriever.rerank_batch(questions, hits_lists, topn=settings.topn_context, timings=timings)
+        with stage_timer("filter", timings):
+            contexts_list = [self._filter_by_majority_product(r) for r in reranked]
+
+        def one(i: int) -> Tuple[str, List[Dict], List[int]]:
+            answer = generate_answer(questions[i], contexts_list[i])
+            sources, used_ids = self._sources(contexts_list[i])
+            return answer, sources, used_ids
+
+        results: List[Tuple[str, List[Dict], List[int]] | Exception] = []
+        with stage_timer("generate", timings):
+            with ThreadPoolExecutor(max_workers=max(1, settings.batch_generate_concurrency)) as pool:
+                futures = [pool.submit(one, i) for i in range(len(questions))]
+                for f in futures:
+                    try:
+                        results.append(f.result())
+                    except Exception as e:
+                        if not return_exceptions:
+                            raise
+                        results.append(e)
+        return results
+
+    def search(self, query: str, rerank: bool = False, product: str | None = None, version: str | None = None,
+               offset: int = 0, limit: int = 10, timings: Dict[str, float] | None = None) -> Tuple[List[Dict], int]:
+        want = offset + limit
+        fetch_k = max(self.retriever.topk, want)
+        if product or version:
+            # фильтр применяется после ANN, поэтому берем кандидатов с запасом
+            fetch_k *= max(1, settings.search_overfetch)
+        fetch_k = min(fetch_k, settings.search_max_k)
+        hits, _ = self.retriever.ann_search(query, topk=fetch_k, timings=timings)
+        with stage_timer("filter", timings):
+            if product:
+                hits = [h for h in hits if str(h.get("product") or "").lower() == product.lower()]
+            if version:
+                hits = [h for h in hits if str(h.get("version") or "") == version]
+        total = len(hits)
+        if rerank:
+            hits = self.retriever.rerank(query, hits, topn=want, timings=timings)
+        page = hits[offset:want]
+        return [self._search_hit(h) for h in page], total
+
+    def _search_hit(self, h: Dict) -> Dict:
+        text = h.get("text") or ""
+        return {
+            "id": h.get("id"),
+            "chunk": h.get("_id"),
+            "score": h.get("_rerank", h.get("_sim")),
+            "sim": h.get("_sim"),
+            "rerank": h.get("_rerank"),
+            "url": h.get("url"),
+            "product": h.get("product"),
+            "version": h.get("version"),
+            "h1": h.get("h1"),
+            "h2": h.get("h2"),
+            "snippet": text[: settings.search_snippet_chars],
+        }
+
+    def _sources(self, contexts: List[Dict]) -> Tuple[List[Dict], List[int]]:
         seen = set()
         sources: List[Dict] = []
         used_ids: List[int] = []
@@ -54,14 +133,27 @@ class Pipeline:
                 })
             if "_id" in h:
                 used_ids.append(int(h["_id"]))
-        return answer, sources, used_ids
+        return sources, used_ids
 
 
 _pipeline: Pipeline | None = None
+_pipeline_lock = threading.Lock()
 
 
 def get_pipeline() -> Pipeline:
+    # Сервис не строит индекс внутри запроса: при его отсутствии запускается фоновое задание загрузки,
+    # а запросы получают 503, пока оно не закончится
     global _pipeline
     if _pipeline is None:
-        _pipeline = Pipeline(auto_bootstrap=True)
+        with _pipeline_lock:
+            if _pipeline is None:
+                from app.ingest.jobs import runner
+
+                runner.ensure_index()
+                _pipeline = Pipeline()
     return _pipeline
+
+
+def reload_index() -> None:
+    if _pipeline is not None:
+        _pipeline.retriever.reload()
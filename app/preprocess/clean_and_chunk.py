@@ -1,12 +1,14 @@
 from __future__ import annotations
-from typing import List, Dict, Iterable, DefaultDict
+from typing import List, Dict, DefaultDict
 from collections import defaultdict
 from pathlib import Path
 from bs4 import BeautifulSoup, NavigableString
 import re
+import json
 import hashlib
 
-from app.utils.io import data_path, write_jsonl, read_jsonl
+from app.crawler import raw_store
+from app.utils.io import data_path, write_jsonl, read_jsonl, iter_jsonl
 from app.config import settings
 
 
@@ -93,68 +95,121 @@ def chunk_text(text: str, words_per_chunk: int, overlap_words: int) -> List[str]
     return chunks
 
 
-def process_raw_to_chunks() -> List[Dict]:
-    manifest_path = data_path("raw", "manifest.jsonl")
-    entries: List[Dict[str, object]]
-    if manifest_path.exists():
-        entries = read_jsonl(manifest_path)
-    else:
-        entries = []
-        raw_root = data_path("raw")
-        for product_dir in raw_root.glob("*_*"):
-            product, version = product_dir.name.split("_", 1)
-            for html_file in product_dir.glob("*.html"):
-                entries.append({"product": product, "version": version, "url": None, "path": str(html_file)})
+STATE_FILE = data_path("clean", "preprocess_state.json")
+
+
+def load_state(params: Dict[str, int]) -> Dict[str, Dict]:
+    # При смене параметров чанкинга прежние чанки не годятся: обрабатываем все заново
+    if not STATE_FILE.exists():
+        return {}
+    state = json.loads(STATE_FILE.read_text(encoding="utf-8"))
+    if state.get("params") != params:
+        return {}
+    return dict(state.get("docs", {}))
+
+
+def load_previous_chunks() -> DefaultDict[str, List[Dict]]:
+    prev: DefaultDict[str, List[Dict]] = defaultdict(list)
+    for f in data_path("chunks").glob("*.jsonl"):
+        for row in iter_jsonl(f):
+            prev[str(row["id"]).rsplit(":", 1)[0]].append(row)
+    return prev
+
+
+def load_entries() -> List[Dict]:
+    if raw_store.MANIFEST_FILE.exists():
+        return read_jsonl(raw_store.MANIFEST_FILE)
+    entries: List[Dict] = []
+    raw_root = data_path("raw")
+    for product_dir in raw_root.glob("*_*"):
+        product, version = product_dir.name.split("_", 1)
+        for html_file in product_dir.glob("*.html"):
+            entries.append({"product": product, "version": version, "url": None, "path": str(html_file)})
+    return entries
+
+
+def doc_to_chunks(e: Dict, doc_key: str, doc_sha: str, full_html: str,
+                  words_per_chunk: int, overlap_words: int) -> List[Dict]:
+    product = str(e["product"])
+    version = str(e["version"])
+    url_from_manifest = e.get("url")
+    canonical = extract_canonical_url(full_html)
+    soup = clean_html(full_html)
+    headers = extract_headers(soup)
+    text = extract_text(soup)
+    if not text:
+        return []
+    final_url = canonical or (url_from_manifest if isinstance(url_from_manifest, str) else None)
+    if not is_allowed_url(final_url, product, version):
+        # пропускаем страницы вне нужной ветки
+        return []
+    rows: List[Dict] = []
+    for idx, ch in enumerate(chunk_text(text, words_per_chunk, overlap_words)):
+        ch_norm = ch.strip()
+        if len(ch_norm) < 80:
+            continue
+        sha = hashlib.sha256(ch_norm.encode("utf-8")).hexdigest()
+        rows.append({
+            "id": f"{doc_key}:{idx}",
+            "text": ch_norm,
+            "meta": {
+                "product": product,
+                "version": version,
+                "url": final_url,
+                "h1": headers.get("h1"),
+                "h2": headers.get("h2"),
+                "sha256": sha,
+                "doc_sha256": doc_sha,
+            },
+        })
+    return rows
 
-    acc: DefaultDict[str, List[Dict]] = defaultdict(list)
-    out_all: List[Dict] = []
+
+def process_raw_to_chunks() -> List[Dict]:
+    entries = load_entries()
 
     words_per_chunk = max(50, int(0.75 * settings.chunk_size))
     overlap_words = max(10, int(0.75 * settings.chunk_overlap))
+    params = {"words_per_chunk": words_per_chunk, "overlap_words": overlap_words}
+    state = load_state(params)
+    prev = load_previous_chunks() if state else defaultdict(list)
+
+    acc: DefaultDict[str, List[Dict]] = defaultdict(list)
+    out_all: List[Dict] = []
+    docs: Dict[str, Dict] = {}
 
     for e in entries:
-        product = str(e["product"])
-        version = str(e["version"])
-        url_from_manifest = e.get("url") if isinstance(e, dict) else None
         html_file = Path(str(e["path"]))
-        if not html_file.exists():
-            continue
-        full_html = html_file.read_text(encoding="utf-8", errors="ignore")
-        canonical = extract_canonical_url(full_html)
-        soup = clean_html(full_html)
-        headers = extract_headers(soup)
-        text = extract_text(soup)
-        if not text:
-            continue
-        final_url = canonical or (url_from_manifest if isinstance(url_from_manifest, str) else None)
-        if not is_allowed_url(final_url, product, version):
-            # пропускаем страницы вне нужной ветки
-            continue
-        chunks = chunk_text(text, words_per_chunk, overlap_words)
-        for idx, ch in enumerate(chunks):
-            ch_norm = ch.strip()
-            if len(ch_norm) < 80:
+        pv = f"{e['product']}_{e['version']}"
+        doc_key = f"{pv}:{e.get('doc_id') or html_file.name.split('.', 1)[0]}"
+        doc_sha = e.get("sha256")
+        full_html: str | None = None
+        if not doc_sha:
+            # старые выгрузки без sha256 в манифесте: хэш считаем по файлу, повторяется только чтение, не разбор
+            if not html_file.exists():
                 continue
-            sha = hashlib.sha256(ch_norm.encode("utf-8")).hexdigest()
-            row = {
-                "id": f"{product}_{version}:{html_file.stem}:{idx}",
-                "text": ch_norm,
-                "meta": {
-                    "product": product,
-                    "version": version,
-                    "url": final_url,
-                    "h1": headers.get("h1"),
-                    "h2": headers.get("h2"),
-                    "sha256": sha,
-                },
-            }
-            pv = f"{product}_{version}"
-            acc[pv].append(row)
-            out_all.append(row)
+            full_html = raw_store.read_text(html_file)
+            doc_sha = raw_store.content_hash(full_html)
+        known = state.get(doc_key, {})
+        # страница без чанков не оставляет строк в файлах; в старом файле ее версии могут лежать устаревшие
+        rows = prev.get(doc_key, []) if known.get("chunks") else []
+        if known.get("sha256") != doc_sha or len(rows) != known.get("chunks"):
+            # содержимое менялось с прошлого прогона; иначе готовые чанки берутся без разбора HTML
+            if full_html is None:
+                if not html_file.exists():
+                    continue
+                full_html = raw_store.read_text(html_file)
+            rows = doc_to_chunks(e, doc_key, doc_sha, full_html, words_per_chunk, overlap_words)
+        docs[doc_key] = {"sha256": doc_sha, "chunks": len(rows)}
+        if rows:
+            # версия без единого чанка не должна затирать свой прошлый файл пустым
+            acc[pv].extend(rows)
+        out_all.extend(rows)
 
     for pv, rows in acc.items():
         out_path = data_path("chunks", f"{pv}.jsonl")
         write_jsonl(out_path, rows)
+    STATE_FILE.write_text(json.dumps({"params": params, "docs": docs}, ensure_ascii=False), encoding="utf-8")
 
     return out_all
 
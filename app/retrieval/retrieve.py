@@ -1,58 +1,206 @@
-from typing import List, Dict, Any, Tuple
+from typing import List, Dict, Any, Iterator, NamedTuple, Tuple, TYPE_CHECKING
+from contextlib import contextmanager
+import threading
+import time
 import numpy as np
-from sentence_transformers import CrossEncoder
 
 from app.config import settings
 from app.embed.ollama_client import OllamaClient
 from app.index import faiss_store
+from app.index.reduce import Reducer
+from app.utils.metrics import COMPONENT_LOADED, INDEX_VECTORS, STARTUP_SECONDS, stage_timer
+
+if TYPE_CHECKING:
+    from sentence_transformers import CrossEncoder
+
+
+class IndexState(NamedTuple):
+    # Все, что относится к одной сборке индекса; при перезагрузке подменяется одной ссылкой
+    index: Any
+    metas: List[Dict[str, Any]]
+    reducer: Reducer | None
+    topk: int
+    sharded: bool
+    version: str
 
 
 class Retriever:
     def __init__(self):
         self.ollama = OllamaClient()
-        self.cross_encoder: CrossEncoder | None = None
-        self.index = None
-        self.metas: List[Dict[str, Any]] = []
+        self.cross_encoder: "CrossEncoder | None" = None
+        self.state: IndexState | None = None
+        self._index_lock = threading.Lock()
+        self._state_lock = threading.Lock()
+        self._reranker_lock = threading.Lock()
+        COMPONENT_LOADED.set_function(lambda: float(self.state is not None), "index")
+        COMPONENT_LOADED.set_function(lambda: float(self.cross_encoder is not None), "reranker")
+        INDEX_VECTORS.set_function(lambda: float(self.state.index.ntotal if self.state is not None else 0))
+
+    @property
+    def topk(self) -> int:
+        state = self.state
+        return state.topk if state is not None else settings.topk
+
+    def use_index(self, index: Any, metas: List[Dict[str, Any]], version: str = "external") -> None:
+        # готовый индекс в памяти (бенчмарки, эксперименты) вместо файлов data/index
+        self.state = IndexState(index, metas, None, settings.topk, False, version)
+
+    def _ensure_loaded(self) -> IndexState:
+        state = self.state
+        if state is not None:
+            return state
+        with self._index_lock:
+            if self.state is None:
+                t0 = time.perf_counter()
+                self.state = self._load(None)
+                STARTUP_SECONDS.set(time.perf_counter() - t0, "index_load")
+            return self.state
+
+    def _load(self, old: IndexState | None) -> IndexState:
+        if not faiss_store.index_exists():
+            raise RuntimeError("Index is not built yet; see GET /ingest for the ingestion job")
+        version = faiss_store.index_version()
+        n_shards = faiss_store.shard_count()
+        metas: List[Dict[str, Any]] = []
+        if n_shards > 1:
+            from app.retrieval.sharded import open_sharded_index
+            if old is not None and old.sharded and len(old.index.urls) == n_shards:
+                # живой ShardedIndex не меняется: новый объект на тех же узлах, но уже с новой сборкой
+                index = old.index.reopen(version)
+            else:
+                index = open_sharded_index(n_shards, version)
+        else:
+            index, metas = faiss_store.load_index(settings.hnsw_ef_search)
+        topk = int(faiss_store.load_params().get("topk", settings.topk))
+        return IndexState(index, metas, Reducer.load(), topk, n_shards > 1, version)
+
+    def reload(self) -> None:
+        # новый индекс загружается полностью до подмены; запросы в полете дорабатывают на своем снимке
+        with self._index_lock:
+            old = self.state
+            if old is None:
+                return
+            new = self._load(old)
+            with self._state_lock:
+                self.state = new
+            if old.index is not new.index and hasattr(old.index, "close"):
+                # старый шардированный индекс закрывается после подмены, когда отпустит последний снимок
+                old.index.close()
+
+    @contextmanager
+    def _snapshot(self) -> Iterator[IndexState]:
+        # один снимок на весь запрос: reducer, индекс и метаданные всегда из одной сборки;
+        # шардированный индекс не закрывается, пока снимок используется
+        self._ensure_loaded()
+        with self._state_lock:
+            state = self.state
+            assert state is not None
+            if state.sharded:
+                state.index.acquire()
+        try:
+            yield state
+        finally:
+            if state.sharded:
+                state.index.release()
 
-    def _ensure_loaded(self) -> None:
-        if self.index is None:
-            self.index, self.metas = faiss_store.load_index(settings.hnsw_ef_search)
+    def index_version(self) -> str:
+        return self._ensure_loaded().version
 
     def _ensure_reranker(self) -> None:
-        if self.cross_encoder is None:
-            self.cross_encoder = CrossEncoder(settings.rerank_model)
+        if self.cross_encoder is not None:
+            return
+        with self._reranker_lock:
+            if self.cross_encoder is None:
+                # sentence_transformers тянет torch: импортируем только когда reranker действительно нужен
+                t0 = time.perf_counter()
+                from sentence_transformers import CrossEncoder
+                t1 = time.perf_counter()
+                self.cross_encoder = CrossEncoder(settings.rerank_model)
+                STARTUP_SECONDS.set(t1 - t0, "import_sentence_transformers")
+                STARTUP_SECONDS.set(time.perf_counter() - t1, "reranker_load")
 
-    def embed_query(self, query: str) -> np.ndarray:
-        vec = self.ollama.embed([query])
+    def embed_queries(self, queries: List[str], state: IndexState | None = None) -> np.ndarray:
+        state = state or self._ensure_loaded()
+        vec = self.ollama.embed(queries)
         vec = vec.astype(np.float32)
         vec = vec / (np.linalg.norm(vec, axis=1, keepdims=True) + 1e-12)
+        if state.reducer is not None:
+            vec = state.reducer.transform(vec)
         return vec
 
-    def ann_search(self, query: str, topk: int | None = None) -> Tuple[List[Dict[str, Any]], np.ndarray]:
-        self._ensure_loaded()
-        qv = self.embed_query(query)
-        sims, ids = faiss_store.search(self.index, qv, topk or settings.topk)
-        ids_list = ids[0].tolist()
+    def embed_query(self, query: str, state: IndexState | None = None) -> np.ndarray:
+        return self.embed_queries([query], state)
+
+    def _hits_from_row(self, metas: List[Dict[str, Any]], sims_row: np.ndarray,
+                       ids_row: np.ndarray) -> List[Dict[str, Any]]:
         hits: List[Dict[str, Any]] = []
-        for rank, idx in enumerate(ids_list):
-            if idx < 0 or idx >= len(self.metas):
+        for rank, idx in enumerate(ids_row.tolist()):
+            if idx < 0 or idx >= len(metas):
                 continue
-            meta = self.metas[idx]
-            meta = dict(meta)
+            meta = dict(metas[idx])
             meta["_id"] = idx
             meta["_rank"] = rank
-            meta["_sim"] = float(sims[0][rank])
+            meta["_sim"] = float(sims_row[rank])
             hits.append(meta)
+        return hits
+
+    def _search_vectors(self, state: IndexState, qv: np.ndarray, topk: int) -> List[List[Dict[str, Any]]]:
+        if state.sharded:
+            return state.index.search_hits(qv, topk)
+        sims, ids = faiss_store.search(state.index, qv, topk)
+        return [self._hits_from_row(state.metas, sims[i], ids[i]) for i in range(len(qv))]
+
+    def ann_search(self, query: str, topk: int | None = None,
+                   timings: Dict[str, float] | None = None) -> Tuple[List[Dict[str, Any]], np.ndarray]:
+        with self._snapshot() as state:
+            with stage_timer("embed", timings):
+                qv = self.embed_query(query, state)
+            with stage_timer("search", timings):
+                hits = self._search_vectors(state, qv, topk or state.topk)[0]
         return hits, qv
 
-    def rerank(self, query: str, hits: List[Dict[str, Any]], topn: int | None = None) -> List[Dict[str, Any]]:
+    def ann_search_batch(self, queries: List[str], topk: int | None = None,
+                         timings: Dict[str, float] | None = None) -> Tuple[List[List[Dict[str, Any]]], np.ndarray]:
+        # Один запрос эмбеддингов и один многострочный поиск FAISS на весь пакет
+        if not queries:
+            self._ensure_loaded()
+            return [], np.zeros((0, 0), dtype=np.float32)
+        with self._snapshot() as state:
+            with stage_timer("embed", timings):
+                qv = self.embed_queries(queries, state)
+            with stage_timer("search", timings):
+                hits_lists = self._search_vectors(state, qv, topk or state.topk)
+        return hits_lists, qv
+
+    def rerank(self, query: str, hits: List[Dict[str, Any]], topn: int | None = None,
+               timings: Dict[str, float] | None = None) -> List[Dict[str, Any]]:
         if not hits:
             return []
         self._ensure_reranker()
         assert self.cross_encoder is not None
         pairs = [(query, h["text"]) for h in hits]
-        scores = self.cross_encoder.predict(pairs).tolist()
+        with stage_timer("rerank", timings):
+            scores = self.cross_encoder.predict(pairs).tolist()
         for h, s in zip(hits, scores):
             h["_rerank"] = float(s)
         hits.sort(key=lambda x: x["_rerank"], reverse=True)
         return hits[: (topn or settings.topn_context)]
+
+    def rerank_batch(self, queries: List[str], hits_lists: List[List[Dict[str, Any]]], topn: int | None = None,
+                     timings: Dict[str, float] | None = None) -> List[List[Dict[str, Any]]]:
+        pairs = [(q, h["text"]) for q, hits in zip(queries, hits_lists) for h in hits]
+        if not pairs:
+            return [[] for _ in hits_lists]
+        self._ensure_reranker()
+        assert self.cross_encoder is not None
+        with stage_timer("rerank", timings):
+            scores = self.cross_encoder.predict(pairs).tolist()
+        out: List[List[Dict[str, Any]]] = []
+        pos = 0
+        for hits in hits_lists:
+            for h in hits:
+                h["_rerank"] = float(scores[pos])
+                pos += 1
+            hits.sort(key=lambda x: x["_rerank"], reverse=True)
+            out.append(hits[: (topn or settings.topn_context)])
+        return out
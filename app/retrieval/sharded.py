@@ -0,0 +1,158 @@
+from __future__ import annotations
+import atexit
+import itertools
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Sequence, Tuple
+
+import httpx
+import numpy as np
+
+from app.config import settings
+from app.embed.backend_pool import parse_urls
+
+
+class ShardedIndex:
+    # Scatter-gather поверх процессов app.index.shard_server: каждый шард отдает свой top-k, здесь они сливаются по score.
+    # Объект привязан к одной сборке (build) и не меняется: каждый запрос называет ее узлам явно
+    def __init__(self, urls: List[str], build: str, procs: Sequence[subprocess.Popen] = ()) -> None:
+        self.urls = [u.rstrip("/") for u in urls]
+        self.build = build
+        # локальные процессы шардов, запущенные под этот индекс (для SHARD_URLS пусто)
+        self.procs = list(procs)
+        self.users = 0
+        self.closing = False
+        self._users_lock = threading.Lock()
+        self.client = httpx.Client(timeout=settings.shard_timeout)
+        try:
+            self.ntotal = sum(self._node_vectors(u) for u in self.urls)
+        except BaseException:
+            self.client.close()
+            raise
+        self.pool = ThreadPoolExecutor(max_workers=len(self.urls), thread_name_prefix="shard")
+
+    def _node_vectors(self, url: str) -> int:
+        # узел, еще не загрузивший эту сборку, перечитывает свой шард с диска (общий том или копия data/index)
+        health = self.client.get(f"{url}/health").json()
+        if health.get("build") != self.build:
+            resp = self.client.post(f"{url}/reload")
+            resp.raise_for_status()
+            health = resp.json()
+        if health.get("build") != self.build:
+            raise RuntimeError(f"Shard node {url} serves build {health.get('build')}, index on disk is {self.build}")
+        return int(health["vectors"])
+
+    def reopen(self, build: str) -> ShardedIndex:
+        # Та же раскладка, новая сборка: узлы держат и прежнюю, поэтому снимки, взятые до подмены,
+        # дорабатывают на ней. Локальные процессы переходят новому объекту, старый закроет только клиента
+        index = ShardedIndex(self.urls, build, self.procs)
+        self.procs = []
+        return index
+
+    def acquire(self) -> None:
+        with self._users_lock:
+            self.users += 1
+
+    def release(self) -> None:
+        with self._users_lock:
+            self.users -= 1
+            done = self.closing and self.users == 0
+        if done:
+            self._shutdown()
+
+    def close(self) -> None:
+        # после подмены индекса: узлы гасятся, когда завершится последний запрос, взявший этот снимок
+        with self._users_lock:
+            self.closing = True
+            done = self.users == 0
+        if done:
+            self._shutdown()
+
+    def _shutdown(self) -> None:
+        self.pool.shutdown(wait=True)
+        self.client.close()
+        stop_local_shards(self.procs)
+
+    def _search_shard(self, url: str, qv: np.ndarray, topk: int) -> List[List[Dict[str, Any]]]:
+        resp = self.client.post(f"{url}/search", json={"vectors": qv.tolist(), "topk": topk, "build": self.build})
+        resp.raise_for_status()
+        return resp.json()["results"]
+
+    def search_hits(self, qv: np.ndarray, topk: int) -> List[List[Dict[str, Any]]]:
+        per_shard = list(self.pool.map(lambda u: self._search_shard(u, qv, topk), self.urls))
+        merged: List[List[Dict[str, Any]]] = []
+        for row in range(len(qv)):
+            hits = [h for shard_rows in per_shard for h in shard_rows[row]]
+            hits.sort(key=lambda h: h["_sim"], reverse=True)
+            hits = hits[:topk]
+            for rank, h in enumerate(hits):
+                h["_id"] = h.pop("_gid")
+                h["_rank"] = rank
+            merged.append(hits)
+        return merged
+
+
+_local_procs: Dict[subprocess.Popen, int] = {}
+_atexit_registered: List[bool] = []
+
+
+def stop_local_shards(procs: Sequence[subprocess.Popen] | None = None) -> None:
+    procs = list(_local_procs) if procs is None else list(procs)
+    for proc in procs:
+        proc.terminate()
+    for proc in procs:
+        try:
+            proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+        _local_procs.pop(proc, None)
+
+
+def spawn_local_shards(n: int, wait_s: float = 120.0) -> Tuple[List[str], List[subprocess.Popen]]:
+    # Порты старой раскладки еще заняты: при перезагрузке новые процессы поднимаются рядом, старые гасятся после подмены
+    busy = {port for proc, port in _local_procs.items() if proc.poll() is None}
+    ports = (p for p in itertools.count(settings.shard_base_port) if p not in busy)
+    urls: List[str] = []
+    procs: List[subprocess.Popen] = []
+    for shard, port in zip(range(n), ports):
+        proc = subprocess.Popen(
+            [sys.executable, "-m", "app.index.shard_server", "--shard", str(shard), "--port", str(port)]
+        )
+        _local_procs[proc] = port
+        procs.append(proc)
+        urls.append(f"http://127.0.0.1:{port}")
+    if not _atexit_registered:
+        atexit.register(stop_local_shards)
+        _atexit_registered.append(True)
+    deadline = time.monotonic() + wait_s
+    pending = list(urls)
+    while pending:
+        if time.monotonic() > deadline:
+            stop_local_shards(procs)
+            raise RuntimeError(f"Shard processes did not start: {pending}")
+        for u in list(pending):
+            try:
+                if httpx.get(f"{u}/health", timeout=1.0).status_code == 200:
+                    pending.remove(u)
+            except httpx.HTTPError:
+                pass
+        if pending:
+            time.sleep(0.2)
+    return urls, procs
+
+
+def open_sharded_index(n_shards: int, build: str) -> ShardedIndex:
+    urls = parse_urls(settings.shard_urls)
+    if urls and len(urls) != n_shards:
+        raise RuntimeError(f"SHARD_URLS lists {len(urls)} nodes, index has {n_shards} shards")
+    if urls:
+        return ShardedIndex(urls, build)
+    urls, procs = spawn_local_shards(n_shards)
+    try:
+        return ShardedIndex(urls, build, procs)
+    except BaseException:
+        stop_local_shards(procs)
+        raise
@@ -1,7 +1,7 @@
 import os
 import re
 from pathlib import Path
-from typing import Iterable, Dict, Any, List
+from typing import Iterable, Iterator, Dict, Any, List
 import orjson
 import pickle
 
@@ -27,14 +27,16 @@ def write_jsonl(path: Path, rows: Iterable[Dict[str, Any]]) -> None:
             f.write(b"\n")
 
 
-def read_jsonl(path: Path) -> List[Dict[str, Any]]:
-    items: List[Dict[str, Any]] = []
+def iter_jsonl(path: Path) -> Iterator[Dict[str, Any]]:
     with path.open("rb") as f:
         for line in f:
             if not line.strip():
                 continue
-            items.append(orjson.loads(line))
-    return items
+            yield orjson.loads(line)
+
+
+def read_jsonl(path: Path) -> List[Dict[str, Any]]:
+    return list(iter_jsonl(path))
 
 
 def write_pickle(path: Path, obj: Any) -> None:
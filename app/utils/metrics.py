@@ -0,0 +1,190 @@
+from __future__ import annotations
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Sequence, Tuple
+
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: Tuple[str, str] | None = None) -> str:
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    escaped = [(k, str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")) for k, v in pairs]
+    return "{" + ",".join(f'{k}="{v}"' for k, v in escaped) + "}"
+
+
+def _format_value(v: float) -> str:
+    if v == float("inf"):
+        return "+Inf"
+    return repr(float(v)) if not float(v).is_integer() else str(int(v))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = ()) -> None:
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()
+
+    def _key(self, values: Sequence[str]) -> Tuple[str, ...]:
+        if len(values) != len(self.labelnames):
+            raise ValueError(f"{self.name}: expected labels {self.labelnames}, got {values}")
+        return tuple(str(v) for v in values)
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = ()) -> None:
+        super().__init__(name, help_text, labelnames)
+        self.values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *labels: str, amount: float = 1.0) -> None:
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0.0) + amount
+
+    def render(self) -> List[str]:
+        with self.lock:
+            items = sorted(self.values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, k)} {_format_value(v)}" for k, v in items]
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = ()) -> None:
+        super().__init__(name, help_text, labelnames)
+        self.values: Dict[Tuple[str, ...], float] = {}
+        self.functions: Dict[Tuple[str, ...], Callable[[], float]] = {}
+
+    def set(self, value: float, *labels: str) -> None:
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = float(value)
+
+    def inc(self, *labels: str, amount: float = 1.0) -> None:
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0.0) + amount
+
+    def dec(self, *labels: str, amount: float = 1.0) -> None:
+        self.inc(*labels, amount=-amount)
+
+    def set_function(self, fn: Callable[[], float], *labels: str) -> None:
+        # значение вычисляется в момент выдачи /metrics
+        key = self._key(labels)
+        with self.lock:
+            self.functions[key] = fn
+
+    def render(self) -> List[str]:
+        with self.lock:
+            items = dict(self.values)
+            functions = dict(self.functions)
+        for key, fn in functions.items():
+            try:
+                items[key] = float(fn())
+            except Exception:
+                continue
+        return [f"{self.name}{_format_labels(self.labelnames, k)} {_format_value(v)}" for k, v in sorted(items.items())]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS) -> None:
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        self.counts: Dict[Tuple[str, ...], List[int]] = {}
+        self.sums: Dict[Tuple[str, ...], float] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        key = self._key(labels)
+        with self.lock:
+            counts = self.counts.setdefault(key, [0] * len(self.buckets))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            self.sums[key] = self.sums.get(key, 0.0) + value
+
+    def render(self) -> List[str]:
+        lines: List[str] = []
+        with self.lock:
+            items = sorted((k, list(v), self.sums[k]) for k, v in self.counts.items())
+        for key, counts, total in items:
+            cumulative = 0
+            for bound, c in zip(self.buckets, counts):
+                cumulative += c
+                le = ("le", _format_value(bound))
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {repr(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self) -> None:
+        self.metrics: Dict[str, _Metric] = {}
+        self.lock = threading.Lock()
+
+    def _register(self, metric: _Metric) -> _Metric:
+        with self.lock:
+            return self.metrics.setdefault(metric.name, metric)
+
+    def counter(self, name: str, help_text: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, help_text, labelnames))  # type: ignore[return-value]
+
+    def gauge(self, name: str, help_text: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self._register(Gauge(name, help_text, labelnames))  # type: ignore[return-value]
+
+    def histogram(self, name: str, help_text: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, help_text, labelnames, buckets))  # type: ignore[return-value]
+
+    def render(self) -> str:
+        with self.lock:
+            metrics = list(self.metrics.values())
+        lines: List[str] = []
+        for metric in metrics:
+            lines.extend(metric.header())
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.histogram("krag_stage_seconds", "Latency of pipeline stages", ["stage"])
+REQUEST_SECONDS = REGISTRY.histogram("krag_request_seconds", "Latency of API requests", ["endpoint"])
+REQUESTS_TOTAL = REGISTRY.counter("krag_requests_total", "API requests by outcome", ["endpoint", "status"])
+SEARCH_OVER_BUDGET = REGISTRY.counter("krag_search_over_budget_total", "/search requests slower than SEARCH_BUDGET_MS")
+OLLAMA_ERRORS = REGISTRY.counter("krag_ollama_errors_total", "Failed Ollama calls", ["endpoint"])
+OLLAMA_INFLIGHT = REGISTRY.gauge("krag_ollama_inflight", "Ollama calls in flight", ["endpoint"])
+COMPONENT_LOADED = REGISTRY.gauge("krag_component_loaded", "Lazily loaded components held in memory", ["component"])
+INDEX_VECTORS = REGISTRY.gauge("krag_index_vectors", "Vectors in the loaded FAISS index")
+STARTUP_SECONDS = REGISTRY.gauge("krag_startup_seconds", "Time spent importing and loading components", ["component"])
+COALESCED_REQUESTS = REGISTRY.counter("krag_coalesced_requests_total", "Requests served by an identical in-flight computation", ["op"])
+SINGLEFLIGHT_INFLIGHT = REGISTRY.gauge("krag_singleflight_inflight", "Distinct computations currently shared by coalescing", ["op"])
+
+
+@contextmanager
+def stage_timer(stage: str, timings: Dict[str, float] | None = None) -> Iterator[None]:
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - t0
+        STAGE_SECONDS.observe(elapsed, stage)
+        if timings is not None:
+            timings[stage] = round(timings.get(stage, 0.0) + elapsed * 1000, 3)
@@ -0,0 +1,47 @@
+from __future__ import annotations
+import threading
+from typing import Any, Callable, Dict, Hashable, Tuple
+
+from app.utils.metrics import COALESCED_REQUESTS, SINGLEFLIGHT_INFLIGHT
+
+
+class _Call:
+    def __init__(self) -> None:
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: BaseException | None = None
+
+
+# Одновременные вызовы с одинаковым ключом выполняют fn один раз и получают общий результат (или исключение)
+class SingleFlight:
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.lock = threading.Lock()
+        self.calls: Dict[Hashable, _Call] = {}
+        SINGLEFLIGHT_INFLIGHT.set_function(lambda: float(len(self.calls)), name)
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Tuple[Any, bool]:
+        with self.lock:
+            call = self.calls.get(key)
+            if call is not None:
+                leader = False
+            else:
+                call = self.calls[key] = _Call()
+                leader = True
+        if not leader:
+            COALESCED_REQUESTS.inc(self.name)
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            # ключ снимаем до пробуждения ожидающих: запрос, пришедший после завершения, считает заново
+            with self.lock:
+                del self.calls[key]
+            call.done.set()
+        return call.result, False